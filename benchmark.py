@@ -0,0 +1,318 @@
+#!/usr/bin/env python3.6
+
+""" Benchmark suite for the Reversi engine, the agents and headless games. """
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from game.agent import AlphaBetaAgent, GreedyAgent, MCTSAgent, RandomAgent, WeightedGreedyAgent
+from game.gameplay.environment import Event, create_environment
+from game.gameplay.matchRunner import play_matches
+
+
+CORPUS_SEED = 20240601
+CORPUS_GAMES = 8
+BACKENDS = ['array', 'bitboard']
+
+
+def build_corpus(num_games=CORPUS_GAMES, seed=CORPUS_SEED):
+    """
+    Return a fixed list of games, each a list of (row, col) moves played
+    by random agents from the opening position with a fixed seed. Both
+    starting colours are covered since new_episode alternates them.
+    """
+    state = np.random.get_state()
+    np.random.seed(seed)
+    env = create_environment('array', verbose=0)
+    agent = RandomAgent(env)
+    games = []
+    for _ in range(num_games):
+        moves = []
+        while True:
+            move = agent.act()
+            moves.append((int(move[0]), int(move[1])))
+            if env.place_a_disk(move[0], move[1]) == Event.END_GAME:
+                break
+        games.append((env.start, moves))
+        env.new_episode()
+    np.random.set_state(state)
+    return games
+
+
+def corpus_positions(games):
+    """ Return every (field, turn) position reached in the corpus games """
+    env = create_environment('array', verbose=0)
+    positions = []
+    for start, moves in games:
+        env.load_position(env.initial_field(), start)
+        for move in moves:
+            positions.append((env.field.copy(), env.turn))
+            env.place_a_disk(*move)
+    return positions
+
+
+def measure(run, calls, repeat, setup=None):
+    """
+    Time run() repeat times and return the per-call statistics in
+    microseconds. setup(), if given, runs untimed before every repeat.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start_time) / calls * 1e6)
+    return {'best_us': min(times), 'mean_us': sum(times) / len(times), 'calls': calls, 'repeat': repeat}
+
+
+def bench_engine(backend, games, positions, repeat):
+    """ Time the engine methods on every corpus position """
+    env = create_environment(backend, verbose=0)
+    loaded = []
+    for field, turn in positions:
+        # Method calls are timed on positions loaded once, as in a running game
+        scratch = create_environment(backend, verbose=0)
+        scratch.load_position(field, turn)
+        loaded.append(scratch)
+    moves = [scratch.possible_moves(scratch.turn) for scratch in loaded]
+    calls = len(loaded)
+
+    def forget_analysis():
+        # Every repeat starts without the cached PositionAnalysis of the
+        # last one, as the first call after a move does
+        for scratch in loaded:
+            scratch._board_changed()
+
+    def over_positions(method):
+        def run():
+            for scratch in loaded:
+                method(scratch)
+        return run
+
+    def is_valid_move():
+        for scratch, legal in zip(loaded, moves):
+            for row, col in legal:
+                scratch.isValidMove(row, col, scratch.turn)
+
+    def place_a_disk():
+        for start, game in games:
+            env.load_position(env.initial_field(), start)
+            for move in game:
+                env.place_a_disk(*move)
+
+    return {
+        'possible_moves': measure(over_positions(lambda e: e.possible_moves(e.turn)), calls, repeat,
+                                  forget_analysis),
+        'isValidMove': measure(is_valid_move, max(sum(map(len, moves)), 1), repeat, forget_analysis),
+        'place_a_disk': measure(place_a_disk, sum(len(game) for _, game in games), repeat),
+        'num_disks_can_filp': measure(over_positions(lambda e: e.num_disks_can_filp(e.turn)), calls, repeat,
+                                      forget_analysis),
+        'liberty_after_next_steps': measure(
+            over_positions(lambda e: e.liberty_after_next_steps(e.turn, e.getOpponent(e.turn))), calls, repeat,
+            forget_analysis),
+        'weighted_score_after_next_steps': measure(
+            over_positions(lambda e: e.weighted_score_after_next_steps(e.turn)), calls, repeat, forget_analysis),
+    }
+
+
+AGENTS = {
+    'random': RandomAgent,
+    'greedy': GreedyAgent,
+    'weighted': WeightedGreedyAgent,
+    # Fixed work per move instead of the usual time budget
+    'alphabeta': lambda env: AlphaBetaAgent(env, time_limit=1e9, max_depth=3, verbose=0),
+    'mcts': lambda env: MCTSAgent(env, simulations=32, num_workers=1, verbose=0),
+}
+
+
+def bench_agents(backend, positions, repeat, stride=16):
+    """ Time act() of every agent on every stride-th corpus position """
+    sample = positions[::stride]
+    results = {}
+    for name, factory in AGENTS.items():
+        agents = []
+
+        def close():
+            for agent in agents:
+                if hasattr(agent, 'close'):
+                    agent.close()
+            agents.clear()
+
+        def setup():
+            # Fresh agents every repeat, so no search starts from a table
+            # or tree filled by the previous one
+            close()
+            for field, turn in sample:
+                scratch = create_environment(backend, verbose=0)
+                scratch.load_position(field, turn)
+                agents.append(factory(scratch))
+
+        def run():
+            np.random.seed(CORPUS_SEED)
+            for agent in agents:
+                agent.act()
+                agent.end_episode()
+
+        results[name] = measure(run, len(sample), repeat, setup)
+        close()
+    return results
+
+
+def bench_games(backend, num_games, repeat):
+    """ Time complete headless games in the current process """
+    results = {}
+    for agent1, agent2 in [('random', 'random'), ('greedy', 'weighted')]:
+        result = measure(lambda: play_matches(agent1, agent2, num_games, backend, seed=CORPUS_SEED),
+                         num_games, repeat)
+        result['games_per_second'] = 1e6 / result['best_us']
+        results[f'{agent1}_vs_{agent2}'] = result
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'corpus_seed': CORPUS_SEED,
+    }
+
+
+def run(output, backends=BACKENDS, repeat=5, num_games=20, only=None):
+    """ Run the benchmarks and write the results as JSON to output """
+    random.seed(CORPUS_SEED)
+    games = build_corpus()
+    positions = corpus_positions(games)
+    results = {}
+    for backend in backends:
+        suites = {
+            'engine': lambda: bench_engine(backend, games, positions, repeat),
+            'agents': lambda: bench_agents(backend, positions, repeat),
+            'games': lambda: bench_games(backend, num_games, repeat),
+        }
+        for suite, bench in suites.items():
+            if only and suite not in only:
+                continue
+            for name, result in bench().items():
+                key = f'{backend}.{suite}.{name}'
+                results[key] = result
+                print(f"{key:<50} {result['best_us']:>12.1f} us")
+
+    report = {'meta': metadata(), 'results': results}
+    if output:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {output}")
+    return report
+
+
+def compare(baseline_path, current_path, threshold=0.10):
+    """
+    Print the change of every benchmark between two result files and
+    return the keys that got slower than baseline * (1 + threshold).
+    """
+    with open(baseline_path) as file:
+        baseline = json.load(file)['results']
+    with open(current_path) as file:
+        current = json.load(file)['results']
+
+    regressions = []
+    for key in sorted(set(baseline) | set(current)):
+        if key not in baseline or key not in current:
+            print(f"{key:<50} {'only in ' + ('current' if key in current else 'baseline'):>30}")
+            continue
+        before, after = baseline[key]['best_us'], current[key]['best_us']
+        change = after / before - 1 if before > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            flag = 'REGRESSION'
+            regressions.append(key)
+        elif change < -threshold:
+            flag = 'faster'
+        print(f"{key:<50} {before:>12.1f} {after:>12.1f} us {100 * change:+7.1f}% {flag}")
+    print(f"{len(regressions)} regressions above {100 * threshold:.0f}%")
+    return regressions
+
+
+def parse_command_line_args(args):
+    """ Parse command-line arguments and organize them into a single structured object. """
+
+    parser = argparse.ArgumentParser(description='Benchmarks of the Reversi engine and agents.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='Run the benchmarks.')
+    run_parser.add_argument(
+        '--output',
+        type=str,
+        default='benchmark.json',
+        help='JSON file the results are written to.',
+    )
+    run_parser.add_argument(
+        '--backend',
+        type=str,
+        choices=BACKENDS,
+        action='append',
+        help='Backends to benchmark (all by default, may be repeated).',
+    )
+    run_parser.add_argument(
+        '--suite',
+        type=str,
+        choices=['engine', 'agents', 'games'],
+        action='append',
+        help='Suites to run (all by default, may be repeated).',
+    )
+    run_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='Timing repeats per benchmark; the best one is reported.',
+    )
+    run_parser.add_argument(
+        '--num-games',
+        type=int,
+        default=20,
+        help='The number of games per full-game benchmark.',
+    )
+
+    compare_parser = commands.add_parser('compare', help='Compare results against a baseline.')
+    compare_parser.add_argument('baseline', type=str, help='Baseline results JSON file.')
+    compare_parser.add_argument('current', type=str, help='Current results JSON file.')
+    compare_parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.10,
+        help='Relative slowdown flagged as a regression.',
+    )
+
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    if args.command == 'run':
+        run(args.output, args.backend or BACKENDS, args.repeat, args.num_games, args.suite)
+    else:
+        regressions = compare(args.baseline, args.current, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,68 @@ class EnvConfig:
         [-20, -40, -5, -5, -5, -5, -40, -20],
         [120, -20, 20, 5, 5, 20, -20, 120]
     ]
+    PROFILE_HISTORY = 1000
+    PROFILE_FORMAT = 'json'
+
+
+class AgentConfig:
+    SEARCH_TIME_LIMIT = 1.0
+    SEARCH_MAX_DEPTH = 60
+    MOBILITY_WEIGHT = 10
+    TT_MEMORY_MB = 16
+    MCTS_SIMULATIONS = 400
+    MCTS_WORKERS = None
+    MCTS_LEAVES_PER_WORKER = 8
+    MCTS_EXPLORATION = 1.4
+    MCTS_PLAYOUT_POLICY = 'random'
+    MCTS_PONDER_SIMULATIONS = 20000
+    ENDGAME_EMPTIES = 0
+    ENDGAME_WORKERS = None
+    ENDGAME_SPLIT_EMPTIES = 12
+    ENDGAME_SORT_EMPTIES = 6
+    SEARCH_VERBOSE = 1
+
+
+class DQNConfig:
+    MEMORY_SIZE = 100000
+    BATCH_SIZE = 64
+    DISCOUNT_FACTOR = 0.95
+    MULTI_STEP_REWARD = True
+    MULTI_STEP_SIZE = 5
+    PRIORITIZED_REPLAY = True
+    PRIORITIZED_RATING = 1
+    PRIORITY_IMPORTANCE = 0.4
+    PRIORITY_EPSILON = 1e-6
+    HIDDEN_LAYERS = [256, 256]
+    DUEL_NETWORK = True
+    INFERENCE_MAX_BATCH = 256
+    INFERENCE_MAX_LATENCY = 0.002
+    INFERENCE_RELOAD_INTERVAL = 1.0
+    # Either dqn or ddqn
+    LEARNING_METHOD = "ddqn"
+    LEARNING_RATE = 2.5e-4
+    GRADIENT_CLIP = 10.0
+    TRAIN_STEPS = 1000000
+    TRAIN_ENVS = 64
+    TRAIN_OPPONENT = 'random'
+    TRAIN_INTERVAL = 4
+    LEARNING_STARTS = 10000
+    TARGET_UPDATE_INTERVAL = 1000
+    ACTOR_SYNC_INTERVAL = 100
+    EPSILON_START = 1.0
+    EPSILON_END = 0.05
+    EPSILON_DECAY_STEPS = 200000
+    CHECKPOINT_INTERVAL = 10000
+    REPORT_INTERVAL = 5.0
+    MODEL_PATH = "models/dqn-latest.npz"
+
+
+class TournamentConfig:
+    GAMES_PER_PAIR = 100
+    CHUNK_SIZE = 10
+    ELO_BASE = 1500
+    ELO_PRIOR_DRAWS = 1
+    ELO_CONFIDENCE_Z = 1.96
 
 
 class GUIConfig:
@@ -17,25 +79,16 @@ class GUIConfig:
     FPS_LIMIT = 60
     CELL_WIDTH = 33
     PANEL_HEIGHT = 20
+    STATS_PANEL_HEIGHT = 48
+    TURBO_RENDER_EVERY = [1, 4, 16, 0]
+    TURBO_SLICE = 50
     TIMESTEP_DELAY = 100
     END_GAME_DELAY = 100
     END_GAME_VIEW_DELAY = 10
 
     # VERSION = 1.06
-    # MEMORY_SIZE = 100000
     # NUM_LAST_FRAMES = 4
     # LEVEL = "snakeai/levels/10x10-blank.json"
     # NUM_EPISODES = -1
-    # BATCH_SIZE = 64
-    # DISCOUNT_FACTOR = 0.95
-    # USE_PRETRAINED_MODEL = False
-    # PRETRAINED_MODEL = "dqn-00000000.model"
-    # # Either sarsa, dqn, ddqn
-    # LEARNING_METHOD = "dqn"
-    # MULTI_STEP_REWARD = False
-    # MULTI_STEP_SIZE = 5
-    # PRIORITIZED_REPLAY = False
-    # PRIORITIZED_RATING = 1
-    # DUEL_NETWORK = False
     # #foodspeed =0 no movement. foodspeed =2 food moves one step every 2 timesteps
     # FOODSPEED = 0
@@ -1,3 +1,6 @@
+from config import DQNConfig
+
+
 class AgentBase(object):
     """ Represesnts an intelligent angent for the snake environment. """
 
@@ -8,11 +11,85 @@ class AgentBase(object):
     def act(self, observation, reward):
         return None
 
+    def act_batch(self, boards, players):
+        """
+        Choose one move for each board of a (N, size, size) stack of Player
+        values, with players holding the Player value to move on each board.
+        Returns the flat indices row * size + col, -1 where no move is legal.
+        """
+        raise NotImplementedError(f'{type(self).__name__} has no batched policy')
+
     def end_episode(self):
         pass
 
+    def ponder(self):
+        """
+        Think about the current position on the opponent's time until stop()
+        is called. Returns at once if stop() was called since clear_stop().
+        """
+        pass
+
+    def clear_stop(self):
+        """ Forget an earlier stop(), before handing ponder() to another thread. """
+        pass
+
+    def stop(self):
+        """ Ask a running act() or ponder() to return as soon as possible. """
+        pass
+
+    def close(self):
+        """ Release the processes or connections held by the agent. """
+        pass
+
 
 from .human import HumanAgent
 from .random import RandomAgent
 from .greedy import GreedyAgent
 from .weightedGreedy import WeightedGreedyAgent
+from .alphaBeta import AlphaBetaAgent
+from .mcts import MCTSAgent
+from .endgame import EndgameAgent, EndgameSolver
+from .dqn import DQNAgent
+
+
+# Names accepted by create_agent
+AGENT_NAMES = ['human', 'random', 'greedy', 'weighted', 'alphabeta', 'mcts', 'dqn']
+
+
+def create_agent(name, env, endgame_empties=0, inference=None):
+    """
+    Create a specific type of Reversi AI agent. With endgame_empties, the
+    agent hands over to the exact endgame solver once that few grids are
+    left empty. With inference, the (address, authkey) endpoint of an
+    InferenceServer, a dqn agent asks the server for its moves instead of
+    loading its own network.
+    Returns:
+        An instance of Ai agent.
+    """
+    if name == 'human':
+        return HumanAgent()
+    agent = _create_ai_agent(name, env, inference)
+    if endgame_empties > 0:
+        return EndgameAgent(agent, env, endgame_empties)
+    return agent
+
+
+def _create_ai_agent(name, env, inference=None):
+    if name == 'random':
+        return RandomAgent(env)
+    if name == 'greedy':
+        return GreedyAgent(env)
+    if name == 'weighted':
+        return WeightedGreedyAgent(env)
+    if name == 'alphabeta':
+        return AlphaBetaAgent(env)
+    if name == 'mcts':
+        return MCTSAgent(env)
+    if name == 'dqn':
+        if inference is not None:
+            from game.learning.inferenceServer import InferenceClient
+            return DQNAgent(env, client=InferenceClient(*inference))
+        from game.learning.qNetwork import load_for_board
+        return DQNAgent(env, network=load_for_board(DQNConfig.MODEL_PATH, env.GRID_NUM))
+
+    raise KeyError(f'Unknown agent type: "{name}"')
@@ -0,0 +1,205 @@
+import time
+import numpy as np
+
+from config import AgentConfig
+from game.agent import AgentBase
+from game.agent.transpositionTable import TranspositionTable
+from game.gameplay.environment import Player
+
+
+class SearchTimeout(Exception):
+    """ Gets raised inside the search when the time budget of a move is used up. """
+    pass
+
+
+class AlphaBetaAgent(AgentBase):
+    """
+    Represents an agent that runs a negamax alpha-beta search with iterative
+    deepening until the time budget of the move runs out.
+    """
+
+    WIN_SCORE = 100000
+
+    def __init__(self, env, time_limit=AgentConfig.SEARCH_TIME_LIMIT,
+                 max_depth=AgentConfig.SEARCH_MAX_DEPTH, verbose=AgentConfig.SEARCH_VERBOSE,
+                 tt_memory_mb=AgentConfig.TT_MEMORY_MB):
+        self.env = env
+        self.table = TranspositionTable(tt_memory_mb)
+        self.name = "AlphaBeta"
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.verbose = verbose
+        self.deadline = 0
+        self.stopped = False
+        self.nodes = 0
+        self.last_stats = {}
+
+    def act(self):
+        env = self.env
+        player = env.turn
+        moves = self.order_moves(env.possible_moves(player))
+        if not moves:
+            return (-1, -1)
+
+        start_time = time.perf_counter()
+        self.deadline = start_time + self.time_limit
+        best_move, best_score, depth_reached = self.deepen(player, moves)
+
+        elapsed = time.perf_counter() - start_time
+        self.last_stats = {
+            'depth': depth_reached,
+            'nodes': self.nodes,
+            'time': elapsed,
+            'nodes_per_second': self.nodes / elapsed if elapsed > 0 else 0.0,
+            'score': best_score,
+            'table': self.table.stats(),
+        }
+        if self.verbose:
+            print(f"{self.name}: move {tuple(best_move)} depth {depth_reached} "
+                  f"score {best_score} {self.nodes} nodes "
+                  f"{self.last_stats['nodes_per_second']:.0f} nodes/s "
+                  f"tt hit rate {self.last_stats['table']['hit_rate']:.2f}")
+        return best_move
+
+    def ponder(self):
+        """
+        Search the position of the opponent to move without a time limit
+        until stop() is called. The transposition table keeps the results,
+        so the search of the next move starts from them.
+        """
+        env = self.env
+        moves = self.order_moves(env.possible_moves(env.turn))
+        if not moves:
+            return
+        self.deadline = float('inf')
+        # A stop() that came first has set stopped; one that comes later resets the deadline
+        if self.stopped:
+            return
+        self.deepen(env.turn, moves)
+
+    def clear_stop(self):
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+        self.deadline = 0
+
+    def deepen(self, player, moves):
+        """
+        Search moves at increasing depth until the deadline passes and
+        return the (move, score, depth) of the deepest finished iteration.
+        """
+        env = self.env
+        self.nodes = 0
+        self.table.new_search()
+        self.table.reset_counters()
+        empties = env.GRID_NUM * env.GRID_NUM - env.num_black_disks() - env.num_white_disks()
+        best_move, best_score, depth_reached = moves[0], 0, 0
+
+        for depth in range(1, min(self.max_depth, empties) + 1):
+            try:
+                score, move = self.search_root(player, moves, depth)
+            except SearchTimeout:
+                break
+            best_move, best_score, depth_reached = move, score, depth
+            # Search the best move of this iteration first in the next one
+            moves.remove(move)
+            moves.insert(0, move)
+            if abs(score) >= self.WIN_SCORE:
+                break
+        return best_move, best_score, depth_reached
+
+    def search_root(self, player, moves, depth):
+        """ Return the (score, move) of the best root move at a fixed depth """
+        env = self.env
+        opponent = env.getOpponent(player)
+        alpha, beta = -np.inf, np.inf
+        best_move = moves[0]
+        for move in moves:
+            env.make_move(move[0], move[1], player)
+            try:
+                score = -self.negamax(opponent, depth - 1, -beta, -alpha)
+            finally:
+                env.unmake_move()
+            if score > alpha:
+                alpha, best_move = score, move
+        return alpha, best_move
+
+    def negamax(self, player, depth, alpha, beta):
+        """ Return the score of the position for player, searched depth plies deep """
+        self.nodes += 1
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+        env = self.env
+        opponent = env.getOpponent(player)
+        moves = env.possible_moves(player)
+        if not moves:
+            if not env.possible_moves(opponent):
+                return self.final_score(player)
+            return -self.negamax(opponent, depth, -beta, -alpha)
+        if depth <= 0:
+            return self.evaluate(player, len(moves))
+
+        key = env.position_key(player)
+        entry = self.table.probe(key)
+        table_move = None
+        if entry is not None:
+            stored_depth, flag, value, table_move = entry
+            if stored_depth >= depth:
+                if flag == TranspositionTable.EXACT:
+                    return value
+                if flag == TranspositionTable.LOWER:
+                    alpha = max(alpha, value)
+                elif flag == TranspositionTable.UPPER:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+
+        original_alpha = alpha
+        best, best_move = -np.inf, None
+        for move in self.order_moves(moves, table_move):
+            env.make_move(move[0], move[1], player)
+            try:
+                score = -self.negamax(opponent, depth - 1, -beta, -alpha)
+            finally:
+                env.unmake_move()
+            if score > best:
+                best, best_move = score, move
+            if best > alpha:
+                alpha = best
+            if alpha >= beta:
+                break
+
+        if best <= original_alpha:
+            flag = TranspositionTable.UPPER
+        elif best >= beta:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        self.table.store(key, depth, flag, best, best_move[0] * env.GRID_NUM + best_move[1])
+        return best
+
+    def evaluate(self, player, num_moves):
+        """ Weighted grid score plus mobility, seen from player """
+        env = self.env
+        score = int(env.weighted_scores(env.field[np.newaxis], player)[0])
+        mobility = num_moves - len(env.possible_moves(env.getOpponent(player)))
+        return score + AgentConfig.MOBILITY_WEIGHT * mobility
+
+    def final_score(self, player):
+        """ Score of a finished game: a win always beats any heuristic score """
+        diff = self.env.num_black_disks() - self.env.num_white_disks()
+        if player == Player.WHITE:
+            diff = -diff
+        return int(np.sign(diff)) * self.WIN_SCORE + diff
+
+    def order_moves(self, moves, first=None):
+        """ Try the stored best move, then the grids with the highest weight """
+        size = self.env.GRID_NUM
+        weights = self.env.WEIGHTS
+        return sorted(moves, key=lambda move: (move[0] * size + move[1] != first,
+                                               -weights[move[0]][move[1]]))
+
+    def end_episode(self):
+        pass
@@ -0,0 +1,51 @@
+import numpy as np
+
+from game.agent import AgentBase
+from game.gameplay.environment import Player
+from game.gameplay.vectorEnvironment import legal_moves, split_sides
+
+
+class DQNAgent(AgentBase):
+    """
+    Represents a Reversi agent that plays the legal move with the highest
+    Q-value of a learned QNetwork. The network either runs in the agent's
+    process or behind an InferenceServer reached through client.
+    """
+
+    def __init__(self, env, network=None, client=None):
+        if (network is None) == (client is None):
+            raise ValueError('DQNAgent needs either a network or an inference client')
+        self.env = env
+        self.network = network
+        self.client = client
+        self.name = "DQN"
+        self.observation = np.zeros(env.observation_shape, dtype=np.int8)
+
+    def act(self):
+        observation = self.env.get_observation(self.observation)
+        if self.client is not None:
+            action = self.client.request(observation)
+        else:
+            legal = observation[None, self.env.LEGAL_PLANE]
+            action = self.network.greedy_actions(observation[None], legal)[0]
+        if action < 0:
+            return (-1, -1)
+        size = self.env.GRID_NUM
+        return [int(action) // size, int(action) % size]
+
+    def act_batch(self, boards, players):
+        boards = np.asarray(boards)
+        own, opp = split_sides(boards, players)
+        legal = legal_moves(boards, players)
+        black = np.broadcast_to((np.asarray(players) == Player.BLACK.value).reshape(-1, 1, 1), own.shape)
+        observations = np.stack([own, opp, legal, black], axis=1)
+        if self.client is not None:
+            return self.client.request_batch(observations).astype(int)
+        return self.network.greedy_actions(observations, legal)
+
+    def end_episode(self):
+        pass
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
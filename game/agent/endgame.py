@@ -0,0 +1,227 @@
+import multiprocessing
+import time
+
+from config import AgentConfig
+from game.agent import AgentBase
+from game.gameplay.bitboard import bitboard_from_array, popcount, shift, shift_table
+from game.gameplay.environment import Environment
+from game.gameplay.geometry import weight_table
+
+
+_worker = {}
+
+
+def _init_worker(size):
+    _worker['solver'] = EndgameSolver(size, num_workers=1)
+
+
+def _search_split(args):
+    """ Search one root move of a split search in a pool process """
+    own, opp, empties, parity, alpha = args
+    solver = _worker['solver']
+    solver.nodes = 0
+    score = -solver.negamax(opp, own, empties, parity, float('-inf'), -alpha, False)
+    return score, solver.nodes
+
+
+class EndgameSolver(object):
+    """
+    Solves Reversi positions exactly by searching to the end of the game.
+    Positions are searched on bitboards with an explicit list of empty
+    grids. Moves in regions (board quadrants) with an odd number of empties
+    are tried first, and the root moves after the first one are split over
+    a process pool.
+    """
+
+    def __init__(self, size=Environment.GRID_NUM, num_workers=AgentConfig.ENDGAME_WORKERS):
+        self.size = size
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.shifts = shift_table(size, Environment.DIRECTION)
+        half = size // 2
+        self.regions = [1 << ((index // size >= half) * 2 + (index % size >= half))
+                        for index in range(size * size)]
+        weights = weight_table(size)
+        self.order = sorted(range(size * size), key=lambda index: -weights[index // size][index % size])
+        self.pool = None
+        self.nodes = 0
+        self.last_stats = {}
+
+        # Pool processes are daemonic and may not start pools of their own
+        if multiprocessing.current_process().daemon:
+            self.num_workers = 1
+
+    def flip_bits(self, move, own, opp):
+        """ Return a bitboard of the disks flipped by placing the move bit """
+        flips = 0
+        for amount, mask in self.shifts:
+            line = 0
+            x = shift(move, amount, mask)
+            while x & opp:
+                line |= x
+                x = shift(x, amount, mask)
+            if x & own:
+                flips |= line
+        return flips
+
+    def ordered(self, empties, parity):
+        """ Return the empties of odd regions first, keeping the static order """
+        regions = self.regions
+        return [index for index in empties if parity & regions[index]] + \
+            [index for index in empties if not parity & regions[index]]
+
+    def mobility(self, own, opp, empties, skip):
+        """ Count the legal moves of own among the empties other than skip """
+        return sum(1 for index in empties if index != skip and self.flip_bits(1 << index, own, opp))
+
+    def negamax(self, own, opp, empties, parity, alpha, beta, passed):
+        """ Return the exact final disk differential of own to move, within (alpha, beta) """
+        self.nodes += 1
+        if not empties:
+            return popcount(own) - popcount(opp)
+
+        regions = self.regions
+        children = []
+        for index in self.ordered(empties, parity):
+            move = 1 << index
+            flips = self.flip_bits(move, own, opp)
+            if flips:
+                children.append((index, move, flips))
+        if len(empties) > AgentConfig.ENDGAME_SORT_EMPTIES and len(children) > 1:
+            # Fastest first: reply to the moves that leave the opponent fewest options
+            children.sort(key=lambda child: self.mobility(opp & ~child[2], own | child[1] | child[2],
+                                                          empties, child[0]))
+
+        best = float('-inf')
+        moved = bool(children)
+        for index, move, flips in children:
+            position = empties.index(index)
+            del empties[position]
+            score = -self.negamax(opp & ~flips, own | move | flips, empties,
+                                  parity ^ regions[index], -beta, -alpha, False)
+            empties.insert(position, index)
+
+            if score > best:
+                best = score
+                if best > alpha:
+                    alpha = best
+                    if alpha >= beta:
+                        break
+
+        if not moved:
+            if passed:
+                return popcount(own) - popcount(opp)
+            return -self.negamax(opp, own, empties, parity, -beta, -alpha, True)
+        return best
+
+    def solve(self, env, player=None):
+        """
+        Return (differential, move): the exact final disk differential of
+        player (the side to move by default) under perfect play, and the
+        (row, col) move that reaches it.
+        """
+        if player is None:
+            player = env.turn
+        size = self.size
+        field = env.field
+        own = bitboard_from_array(field == player.value)
+        opp = bitboard_from_array(field == env.getOpponent(player).value)
+        empties = [index for index in self.order if not (own | opp) >> index & 1]
+        parity = 0
+        for index in empties:
+            parity ^= self.regions[index]
+
+        start_time = time.perf_counter()
+        self.nodes = 0
+        children = []
+        for index in self.ordered(empties, parity):
+            move = 1 << index
+            flips = self.flip_bits(move, own, opp)
+            if flips:
+                rest = [other for other in empties if other != index]
+                children.append((index, (opp & ~flips, own | move | flips, rest, parity ^ self.regions[index])))
+        if not children:
+            return popcount(own) - popcount(opp), (-1, -1)
+
+        # Search the first move alone, then split the others with its score as bound
+        best_index, (next_opp, next_own, rest, next_parity) = children[0]
+        best = -self.negamax(next_opp, next_own, rest, next_parity, float('-inf'), float('inf'), False)
+        others = children[1:]
+        if others and self.num_workers > 1 and len(empties) >= AgentConfig.ENDGAME_SPLIT_EMPTIES:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.num_workers, _init_worker, (size,))
+            jobs = [(child_own, child_opp, rest, child_parity, best)
+                    for _, (child_opp, child_own, rest, child_parity) in others]
+            results = self.pool.map(_search_split, jobs, chunksize=1)
+            for (index, _), (score, nodes) in zip(others, results):
+                self.nodes += nodes
+                if score > best:
+                    best, best_index = score, index
+        else:
+            for index, (child_opp, child_own, rest, child_parity) in others:
+                score = -self.negamax(child_opp, child_own, rest, child_parity, float('-inf'), -best, False)
+                if score > best:
+                    best, best_index = score, index
+
+        elapsed = time.perf_counter() - start_time
+        self.last_stats = {
+            'empties': len(empties),
+            'differential': best,
+            'nodes': self.nodes,
+            'time': elapsed,
+            'nodes_per_second': self.nodes / elapsed if elapsed > 0 else 0.0,
+        }
+        return best, (best_index // size, best_index % size)
+
+    def close(self):
+        """ Stop the split-search processes """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+class EndgameAgent(AgentBase):
+    """
+    Wraps another agent and hands the game over to the exact endgame solver
+    once the number of empty grids drops to the threshold.
+    """
+
+    def __init__(self, agent, env, empties=AgentConfig.ENDGAME_EMPTIES,
+                 verbose=AgentConfig.SEARCH_VERBOSE):
+        self.agent = agent
+        self.env = env
+        self.name = agent.name
+        self.empties = empties
+        self.verbose = verbose
+        self.solver = EndgameSolver(env.GRID_NUM)
+
+    def begin_episode(self):
+        self.agent.begin_episode()
+
+    def act(self):
+        env = self.env
+        empties = env.GRID_NUM * env.GRID_NUM - env.num_black_disks() - env.num_white_disks()
+        if empties > self.empties:
+            return self.agent.act()
+
+        differential, move = self.solver.solve(env)
+        if self.verbose:
+            stats = self.solver.last_stats
+            print(f"{self.name} endgame: move {move} exact differential {differential:+d} "
+                  f"({stats['empties']} empties, {stats['nodes']} nodes, {stats['time']:.3f}s)")
+        return move
+
+    def ponder(self):
+        self.agent.ponder()
+
+    def clear_stop(self):
+        self.agent.clear_stop()
+
+    def stop(self):
+        self.agent.stop()
+
+    def end_episode(self):
+        self.agent.end_episode()
+
+    def close(self):
+        self.agent.close()
+        self.solver.close()
@@ -3,6 +3,7 @@ import numpy as np
 
 from game.agent import AgentBase
 from game.gameplay.environment import Environment
+from game.gameplay.vectorEnvironment import captured_disks, choose_moves
 
 
 class GreedyAgent(AgentBase):
@@ -17,5 +18,9 @@ class GreedyAgent(AgentBase):
         max_flips_index = np.argwhere(flip_num == flip_num.max())
         return max_flips_index[np.random.randint(len(max_flips_index))]
 
+    def act_batch(self, boards, players):
+        flip_num = captured_disks(boards, players)
+        return choose_moves(flip_num, flip_num > 0)
+
     def end_episode(self):
         pass
@@ -0,0 +1,250 @@
+import math
+import multiprocessing
+import os
+import time
+import numpy as np
+
+from config import AgentConfig
+from game.agent import AgentBase
+from game.agent.greedy import GreedyAgent
+from game.agent.random import RandomAgent
+from game.gameplay.environment import Event, Player
+
+
+_worker = {}
+
+
+def _init_worker(env_class, policy, size):
+    """ Seed a pool process and create its playout environment """
+    np.random.seed((os.getpid() * 7919 + int(time.time() * 1000)) % 2 ** 32)
+    _setup_playouts(env_class, policy, size)
+
+
+def _setup_playouts(env_class, policy, size):
+    """ Create the environment and the policy used by playouts in this process """
+    env = env_class(size=size)
+    _worker['config'] = (env_class, policy, size)
+    _worker['env'] = env
+    _worker['agent'] = GreedyAgent(env) if policy == 'greedy' else RandomAgent(env)
+
+
+def _run_playouts(positions):
+    """ Play every (field, turn) position to the end and return the winners """
+    env = _worker['env']
+    agent = _worker['agent']
+    winners = []
+    for field, turn in positions:
+        env.load_position(field, Player(turn))
+        while True:
+            move = agent.act()
+            if env.place_a_disk(move[0], move[1]) == Event.END_GAME:
+                break
+        winners.append(env.winning_player().value)
+    return winners
+
+
+class Node(object):
+    """ A position of the search tree with its visit and win statistics """
+
+    def __init__(self, field, turn, key, parent=None, move=None, terminal=False):
+        self.field = field
+        self.turn = turn
+        self.key = key
+        self.parent = parent
+        self.move = move
+        self.terminal = terminal
+        self.children = []
+        self.untried = None
+        self.visits = 0
+        self.wins = 0.0
+
+    def ucb_child(self, exploration):
+        """ Return the child with the highest UCT score """
+        log_visits = math.log(max(self.visits, 1))
+        return max(self.children, key=lambda child: child.wins / child.visits +
+                   exploration * math.sqrt(log_visits / child.visits))
+
+
+class MCTSAgent(AgentBase):
+    """
+    Represents an agent that runs Monte Carlo Tree Search with UCT. Leaves
+    are selected in batches with virtual loss and their playouts run in a
+    process pool (leaf parallelism). The subtree of the position reached
+    after each move is kept for the next search.
+    """
+
+    def __init__(self, env, simulations=AgentConfig.MCTS_SIMULATIONS,
+                 num_workers=AgentConfig.MCTS_WORKERS, policy=AgentConfig.MCTS_PLAYOUT_POLICY,
+                 exploration=AgentConfig.MCTS_EXPLORATION, verbose=AgentConfig.SEARCH_VERBOSE):
+        self.env = env
+        self.name = "MCTS"
+        self.simulations = simulations
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.policy = policy
+        self.exploration = exploration
+        self.verbose = verbose
+        self.scratch = type(env)(size=env.GRID_NUM)
+        self.root = None
+        self.pool = None
+        self.stopped = False
+        self.last_stats = {}
+
+        # Pool processes are daemonic and may not start pools of their own
+        if multiprocessing.current_process().daemon:
+            self.num_workers = 1
+
+    def act(self):
+        env = self.env
+        if not env.possible_moves(env.turn):
+            return (-1, -1)
+
+        start_time = time.perf_counter()
+        self.stopped = False
+        self.root = self.find_root()
+        playouts = self.simulate(self.simulations)
+
+        best = max(self.root.children, key=lambda child: child.visits)
+        elapsed = time.perf_counter() - start_time
+        self.last_stats = {
+            'playouts': playouts,
+            'time': elapsed,
+            'playouts_per_second': playouts / elapsed if elapsed > 0 else 0.0,
+            'root_visits': self.root.visits,
+            'win_rate': best.wins / best.visits,
+        }
+        if self.verbose:
+            print(f"{self.name}: move {best.move} win rate {self.last_stats['win_rate']:.2f} "
+                  f"{playouts} playouts {self.last_stats['playouts_per_second']:.0f} playouts/s "
+                  f"({self.num_workers} workers, {self.root.visits} root visits)")
+
+        # Keep the chosen subtree for the next move
+        self.root = best
+        best.parent = None
+        return list(best.move)
+
+    def ponder(self):
+        """
+        Grow the tree of the position of the opponent to move until stop()
+        is called (or MCTS_PONDER_SIMULATIONS playouts). The next act()
+        reuses the subtree of the move the opponent plays.
+        """
+        env = self.env
+        if self.stopped or not env.possible_moves(env.turn):
+            return
+        self.root = self.find_root()
+        self.simulate(AgentConfig.MCTS_PONDER_SIMULATIONS)
+
+    def clear_stop(self):
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def simulate(self, simulations):
+        """ Run playouts from the root in batches until simulations are done or stop() is called """
+        playouts = 0
+        batch = self.num_workers * AgentConfig.MCTS_LEAVES_PER_WORKER
+        while True:
+            leaves = [self.select_leaf() for _ in range(min(batch, simulations - playouts))]
+            self.backpropagate(leaves, self.evaluate_leaves(leaves))
+            playouts += len(leaves)
+            if playouts >= simulations or self.stopped:
+                return playouts
+
+    def find_root(self):
+        """ Reuse the node of the current position from the last tree if there is one """
+        env = self.env
+        key = env.position_key()
+        if self.root is not None:
+            frontier = [self.root]
+            for depth in range(3):
+                for node in frontier:
+                    if node.key == key and np.array_equal(node.field, env.field):
+                        node.parent = None
+                        return node
+                frontier = [child for node in frontier for child in node.children]
+        return Node(np.array(env.field, dtype=np.int8), env.turn, key)
+
+    def expand(self, node):
+        """ Create the child reached by one untried move of node """
+        scratch = self.scratch
+        if node.untried is None:
+            scratch.load_position(node.field, node.turn)
+            node.untried = scratch.possible_moves(node.turn)
+            np.random.shuffle(node.untried)
+        move = node.untried.pop()
+
+        scratch.load_position(node.field, node.turn)
+        event = scratch.place_a_disk(move[0], move[1])
+        child = Node(np.array(scratch.field, dtype=np.int8), scratch.turn, scratch.position_key(),
+                     node, tuple(move), event == Event.END_GAME)
+        node.children.append(child)
+        return child
+
+    def select_leaf(self):
+        """ Walk down the tree by UCT and expand one leaf, adding a virtual loss on the path """
+        node = self.root
+        while not node.terminal:
+            if node.untried is None or node.untried:
+                node = self.expand(node)
+                break
+            node = node.ucb_child(self.exploration)
+
+        walk = node
+        while walk is not None:
+            walk.visits += 1
+            walk = walk.parent
+        return node
+
+    def evaluate_leaves(self, leaves):
+        """ Return the winner value of a playout from every leaf """
+        winners = [None] * len(leaves)
+        jobs, positions = [], []
+        for index, leaf in enumerate(leaves):
+            if leaf.terminal:
+                self.scratch.load_position(leaf.field, leaf.turn)
+                winners[index] = self.scratch.winning_player().value
+            else:
+                jobs.append(index)
+                positions.append((leaf.field, leaf.turn.value))
+
+        if self.num_workers == 1:
+            config = (type(self.env), self.policy, self.env.GRID_NUM)
+            if _worker.get('config') != config:
+                _setup_playouts(*config)
+            results = _run_playouts(positions)
+        else:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.num_workers, _init_worker,
+                                                 (type(self.env), self.policy, self.env.GRID_NUM))
+            size = math.ceil(len(positions) / self.num_workers) or 1
+            chunks = [positions[start:start + size] for start in range(0, len(positions), size)]
+            results = [winner for chunk in self.pool.map(_run_playouts, chunks) for winner in chunk]
+
+        for index, winner in zip(jobs, results):
+            winners[index] = winner
+        return winners
+
+    def backpropagate(self, leaves, winners):
+        """
+        Credit every node with the result seen by the player who moved into
+        it. Visits were already counted as virtual losses by select_leaf.
+        """
+        for leaf, winner in zip(leaves, winners):
+            node = leaf
+            while node.parent is not None:
+                mover = node.parent.turn.value
+                if winner == mover:
+                    node.wins += 1
+                elif winner == Player.NONE.value:
+                    node.wins += 0.5
+                node = node.parent
+
+    def end_episode(self):
+        self.root = None
+
+    def close(self):
+        """ Stop the playout processes """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
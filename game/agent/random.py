@@ -3,6 +3,7 @@ import numpy as np
 
 from game.agent import AgentBase
 from game.gameplay.environment import Environment
+from game.gameplay.vectorEnvironment import choose_moves, legal_moves
 
 
 class RandomAgent(AgentBase):
@@ -18,5 +19,9 @@ class RandomAgent(AgentBase):
             return (-1, -1)
         return moves[np.random.randint(len(moves))]
 
+    def act_batch(self, boards, players):
+        legal = legal_moves(boards, players)
+        return choose_moves(np.zeros(legal.shape), legal)
+
     def end_episode(self):
         pass
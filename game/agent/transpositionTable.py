@@ -0,0 +1,89 @@
+import numpy as np
+
+from config import AgentConfig
+
+
+class TranspositionTable(object):
+    """
+    Fixed-size hash table of search results keyed by Zobrist position keys.
+    Every slot stores the key, search depth, bound type, value and best move
+    of one position. The number of slots follows from the memory cap.
+    """
+
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+    ENTRY_BYTES = 8 + 4 + 2 + 1 + 1 + 1
+
+    def __init__(self, memory_mb=AgentConfig.TT_MEMORY_MB):
+        self.size = max(1, int(memory_mb * 1024 * 1024) // self.ENTRY_BYTES)
+        self.keys = np.zeros(self.size, dtype=np.uint64)
+        self.values = np.zeros(self.size, dtype=np.int32)
+        self.moves = np.zeros(self.size, dtype=np.int16)
+        self.depths = np.zeros(self.size, dtype=np.int8)
+        self.flags = np.zeros(self.size, dtype=np.int8)
+        self.ages = np.zeros(self.size, dtype=np.uint8)
+        self.age = 0
+        self.clear()
+
+    def clear(self):
+        """ Empty the table and reset the counters """
+        self.depths.fill(-1)
+        self.age = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+        self.rejected = 0
+
+    def new_search(self):
+        """ Age the stored entries so the next search prefers to replace them """
+        self.age = (self.age + 1) % 256
+
+    def probe(self, key):
+        """ Return (depth, flag, value, move) stored for key, or None """
+        index = key % self.size
+        if self.depths[index] >= 0 and int(self.keys[index]) == key:
+            self.hits += 1
+            return int(self.depths[index]), int(self.flags[index]), \
+                int(self.values[index]), int(self.moves[index])
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, flag, value, move=-1):
+        """
+        Store a search result. A slot holding another position is only
+        replaced when its entry comes from an older search or was searched
+        less deeply (depth-preferred replacement with aging).
+        """
+        index = key % self.size
+        if self.depths[index] >= 0 and int(self.keys[index]) != key:
+            if self.ages[index] == self.age and self.depths[index] > depth:
+                self.rejected += 1
+                return
+            self.overwrites += 1
+        self.keys[index] = key
+        self.depths[index] = min(depth, 127)
+        self.flags[index] = flag
+        self.values[index] = value
+        self.moves[index] = move
+        self.ages[index] = self.age
+        self.stores += 1
+
+    def stats(self):
+        """ Return the counters used to tune the table size """
+        probes = self.hits + self.misses
+        return {
+            'size': self.size,
+            'memory_mb': self.size * self.ENTRY_BYTES / (1024 * 1024),
+            'used': int(np.count_nonzero(self.depths >= 0)),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / probes if probes else 0.0,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'rejected': self.rejected,
+        }
@@ -3,6 +3,8 @@ import numpy as np
 
 from game.agent import AgentBase
 from game.gameplay.environment import Environment
+from game.gameplay.geometry import weight_table
+from game.gameplay.vectorEnvironment import captured_disks, choose_moves, legal_moves, split_sides
 
 
 class WeightedGreedyAgent(AgentBase):
@@ -18,5 +20,13 @@ class WeightedGreedyAgent(AgentBase):
         move = moves[np.random.randint(len(moves))]
         return move
 
+    def act_batch(self, boards, players):
+        weights = np.array(weight_table(boards.shape[-1]))
+        own, opp = split_sides(boards, players)
+        score = np.tensordot(own.astype(int) - opp, weights, axes=2)
+        # A move gains its own grid and twice the weight of every disk it flips
+        scores = score[:, None, None] + weights + 2 * captured_disks(boards, players, weights)
+        return choose_moves(scores, legal_moves(boards, players))
+
     def end_episode(self):
         pass
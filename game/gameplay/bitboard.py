@@ -0,0 +1,284 @@
+import numpy as np
+
+from game.gameplay.environment import Environment, Player
+from game.gameplay.zobrist import hash_field, zobrist_keys
+
+
+def popcount(bitboard):
+    """ Return the number of set bits of a bitboard """
+    return bin(bitboard).count("1")
+
+
+def iterate_bits(bitboard):
+    """ Yield the index of every set bit, lowest bit first """
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+
+def bitboard_from_array(cells):
+    """ Pack a boolean (size, size) array into a bitboard """
+    packed = np.packbits(np.asarray(cells, dtype=np.uint8).ravel(), bitorder="little")
+    return int.from_bytes(packed.tobytes(), "little")
+
+
+def bitboard_to_array(bitboard, size):
+    """ Unpack a bitboard into a (size, size) array of 0 and 1 """
+    num_bytes = (size * size + 7) // 8
+    raw = np.frombuffer(bitboard.to_bytes(num_bytes, "little"), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder="little")[:size * size].reshape(size, size)
+
+
+def bitboards_to_arrays(bitboards, size):
+    """ Unpack a list of bitboards into a (len(bitboards), size, size) array """
+    num_bytes = (size * size + 7) // 8
+    raw = np.frombuffer(b"".join(bitboard.to_bytes(num_bytes, "little") for bitboard in bitboards),
+                        dtype=np.uint8).reshape(len(bitboards), num_bytes)
+    cells = np.unpackbits(raw, axis=1, bitorder="little")[:, :size * size]
+    return cells.reshape(len(bitboards), size, size)
+
+
+def shift_table(size, directions):
+    """
+    Build (shift, mask) pairs that move every bit of a bitboard one step
+    along each direction. The mask drops the bits that wrap around a row.
+    """
+    full = (1 << size * size) - 1
+    first_col = sum(1 << (row * size) for row in range(size))
+    last_col = first_col << (size - 1)
+
+    table = []
+    for direction in directions:
+        mask = full
+        if direction[1] == 1:
+            mask &= ~first_col
+        elif direction[1] == -1:
+            mask &= ~last_col
+        table.append((direction[0] * size + direction[1], mask))
+    return table
+
+
+def shift(bitboard, amount, mask):
+    """ Shift a bitboard by one step of a direction """
+    if amount > 0:
+        return (bitboard << amount) & mask
+    return (bitboard >> -amount) & mask
+
+
+class BitboardEnvironment(Environment):
+    """
+    Represents the Reversi environment with both sides stored as bitboards.
+    Bit ``row * GRID_NUM + col`` of a side is set when that side holds the
+    disk on (row, col). It keeps the public API of Environment, so the GUI
+    and the agents can use it as a drop-in replacement.
+    """
+
+    SHIFTS = shift_table(Environment.GRID_NUM, Environment.DIRECTION)
+    FULL = (1 << Environment.GRID_NUM * Environment.GRID_NUM) - 1
+    BIT_KEYS = [sum(rows, []) for rows in Environment.ZOBRIST_KEYS]
+
+    def __init__(self, output=".", verbose=1, check_consistency=False, profile=False, size=Environment.GRID_NUM):
+        """
+        Create a new bitboard Reversi environment on a size x size board.
+        check_consistency is accepted for the same signature as Environment
+        and ignored: the bitboards keep no incremental caches to check.
+        """
+        self.black = 0
+        self.white = 0
+        if size != self.GRID_NUM:
+            self.SHIFTS = shift_table(size, self.DIRECTION)
+            self.FULL = (1 << size * size) - 1
+            self.BIT_KEYS = [sum(rows, []) for rows in zobrist_keys(size)]
+        super().__init__(output, verbose, profile=profile, size=size)
+
+    @property
+    def field(self):
+        """ The board as a (GRID_NUM, GRID_NUM) array of Player values """
+        size = self.GRID_NUM
+        return (Player.BLACK.value * bitboard_to_array(self.black, size) +
+                Player.WHITE.value * bitboard_to_array(self.white, size)).astype(float)
+
+    @field.setter
+    def field(self, field):
+        self.black, self.white = self.__bitboards_of(field)
+        self.hash = hash_field(field, self.ZOBRIST_KEYS)
+        self._board_changed()
+
+    def __bitboards_of(self, field):
+        """ Return the (black, white) bitboards of a field array """
+        field = np.asarray(field)
+        return (bitboard_from_array(field == Player.BLACK.value),
+                bitboard_from_array(field == Player.WHITE.value))
+
+    def __sides(self, player, field=None):
+        """ Return the (own, opponent) bitboards of player """
+        if field is None:
+            black, white = self.black, self.white
+        else:
+            black, white = self.__bitboards_of(field)
+        if player == Player.BLACK:
+            return black, white
+        return white, black
+
+    def __bit(self, row, col):
+        # agents may hand in numpy integers, which would overflow the shift
+        return 1 << int(row * self.GRID_NUM + col)
+
+    def move_bits(self, own, opp):
+        """ Return a bitboard of all legal moves of own against opp """
+        empty = ~(own | opp) & self.FULL
+        moves = 0
+        for amount, mask in self.SHIFTS:
+            x = shift(own, amount, mask) & opp
+            for _ in range(self.GRID_NUM - 3):
+                x |= shift(x, amount, mask) & opp
+            moves |= shift(x, amount, mask) & empty
+        return moves
+
+    def flip_bits(self, move, own, opp):
+        """ Return a bitboard of the disks flipped by placing the move bit """
+        flips = 0
+        for amount, mask in self.SHIFTS:
+            line = 0
+            x = shift(move, amount, mask)
+            while x & opp:
+                line |= x
+                x = shift(x, amount, mask)
+            if x & own:
+                flips |= line
+        return flips
+
+    def liberty_after_next_steps(self, current_player, target):
+        """ return the numbers of liberty of next steps """
+        size = self.GRID_NUM
+        liberty = np.zeros(shape=(size, size))
+        own, opp = self.__sides(current_player)
+        for index in iterate_bits(self.move_bits(own, opp)):
+            move = 1 << index
+            flips = self.flip_bits(move, own, opp)
+            next_own, next_opp = own | move | flips, opp & ~flips
+            if target != current_player:
+                next_own, next_opp = next_opp, next_own
+            liberty[index // size][index % size] = popcount(self.move_bits(next_own, next_opp))
+        return liberty
+
+    def successor_fields(self, player, moves):
+        """ return a (len(moves), GRID_NUM, GRID_NUM) stack of the boards after each move """
+        size = self.GRID_NUM
+        own, opp = self.__sides(player)
+        owns, opps = [], []
+        for row, col in moves:
+            move = self.__bit(row, col)
+            flips = self.flip_bits(move, own, opp)
+            owns.append(own | move | flips)
+            opps.append(opp & ~flips)
+        return (player.value * bitboards_to_arrays(owns, size) +
+                self.getOpponent(player).value * bitboards_to_arrays(opps, size)).astype(float)
+
+    def num_disks_can_filp(self, player, field=None):
+        """ return the numbers of disks can be filpped """
+        size = self.GRID_NUM
+        flip_num = np.zeros(shape=(size, size))
+        own, opp = self.__sides(player, field)
+        for index in iterate_bits(self.move_bits(own, opp)):
+            flip_num[index // size][index % size] = popcount(self.flip_bits(1 << index, own, opp))
+        return flip_num
+
+    def is_grid_free(self, row, col, field=None):
+        """ check if a grid is available """
+        if field is not None:
+            return super().is_grid_free(row, col, field)
+        return not (self.black | self.white) & self.__bit(row, col)
+
+    def is_holded_by_player(self, player, row, col, field=None):
+        """ check if a grid is holded by a single player """
+        if field is not None or player == Player.NONE:
+            return super().is_holded_by_player(player, row, col, field)
+        return bool(self.__sides(player)[0] & self.__bit(row, col))
+
+    def is_holded_by_opponent(self, player, row, col, field=None):
+        """ check if a grid is holded by the opponent player """
+        return self.is_holded_by_player(self.getOpponent(player), row, col, field)
+
+    def isValidMove(self, row, col, player, field=None):
+        """ Check if a move is valid """
+        if self.not_in_grid(row, col):
+            return False
+        own, opp = self.__sides(player, field)
+        move = self.__bit(row, col)
+        if (own | opp) & move:
+            return False
+        return self.flip_bits(move, own, opp) != 0
+
+    def _generate_moves(self, player, field=None):
+        """ Find the legal moves of player on field, the current board by default """
+        size = self.GRID_NUM
+        own, opp = self.__sides(player, field)
+        return [[index // size, index % size] for index in iterate_bits(self.move_bits(own, opp))]
+
+    def _apply_move(self, row, col, player):
+        """ place player's disk on the board and flip the captured disks """
+        own, opp = self.__sides(player)
+        index = int(row * self.GRID_NUM + col)
+        move = 1 << index
+        flips = self.flip_bits(move, own, opp)
+        own, opp = own | move | flips, opp & ~flips
+        if player == Player.BLACK:
+            self.black, self.white = own, opp
+        else:
+            self.white, self.black = own, opp
+
+        own_keys = self.BIT_KEYS[player.value]
+        opp_keys = self.BIT_KEYS[self.getOpponent(player).value]
+        value = self.hash ^ own_keys[index]
+        for flipped in iterate_bits(flips):
+            value ^= own_keys[flipped] ^ opp_keys[flipped]
+        self.hash = value
+        self._board_changed()
+        return flips
+
+    def _reset_move_cache(self):
+        """ Bitboards generate moves on demand, so there is nothing to cache """
+        pass
+
+    def make_move(self, row, col, player):
+        """
+        Place player's disk in-place and push the previous position on the
+        undo stack. The move is not validated and the turn is left unchanged.
+        """
+        size = self.GRID_NUM
+        self.undo_stack.append((self.black, self.white, self.hash))
+        flips = self._apply_move(row, col, player)
+        return [(index // size, index % size) for index in iterate_bits(flips)]
+
+    def unmake_move(self):
+        """ Take back the last move made by make_move """
+        self.black, self.white, self.hash = self.undo_stack.pop()
+        self._board_changed()
+
+    def get_observation(self, out=None, player=None):
+        """ Observe the state of the environment, see Environment.get_observation """
+        if player is None:
+            player = self.turn
+        if out is None:
+            out = np.zeros(self.observation_shape, dtype=np.float32)
+        size = self.GRID_NUM
+        own, opp = self.__sides(player)
+        out[0] = bitboard_to_array(own, size)
+        out[1] = bitboard_to_array(opp, size)
+        out[self.LEGAL_PLANE] = bitboard_to_array(self.move_bits(own, opp), size)
+        out[3] = player == Player.BLACK
+        return out
+
+    def _count_disks(self):
+        """ Count the (black, white) disks on the current board """
+        return popcount(self.black), popcount(self.white)
+
+    def isWhite(self, row, col):
+        """ Check if a disk is white """
+        return bool(self.white & self.__bit(row, col))
+
+    def isBlack(self, row, col):
+        """ Check if a disk is black """
+        return bool(self.black & self.__bit(row, col))
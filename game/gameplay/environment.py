@@ -3,10 +3,11 @@ import time
 import os
 
 import numpy as np
-from copy import deepcopy
 from enum import Enum
 
 from config import EnvConfig
+from game.gameplay.geometry import DIRECTIONS, ray_table, weight_table
+from game.gameplay.zobrist import zobrist_keys, side_key, hash_field
 
 
 class Environment(object):
@@ -16,15 +17,42 @@ class Environment(object):
     """
 
     GRID_NUM = EnvConfig.DIMENSION_OF_GRID
-    WEIGHTS = EnvConfig.GRID_WEIGHT_8x8
-    DIRECTION = [[-1, 0], [-1, 1], [1, 1], [0, 1], [1, 0], [1, -1], [0, -1], [-1, -1]]
-
-    def __init__(self, output=".", verbose=1):
+    WEIGHTS = weight_table(GRID_NUM)
+    WEIGHT_ARRAY = np.array(WEIGHTS)
+    DIRECTION = [list(direction) for direction in DIRECTIONS]
+    ZOBRIST_KEYS = zobrist_keys(GRID_NUM)
+    RAYS = ray_table(GRID_NUM)
+    SIDE_KEY = side_key()
+    # Plane of get_observation that marks the legal moves
+    LEGAL_PLANE = 2
+
+    def __init__(self, output=".", verbose=1, check_consistency=False, profile=False,
+                 size=EnvConfig.DIMENSION_OF_GRID):
         """
-        Create a new Reversi environment.
+        Create a new Reversi environment on a size x size board.
+        With check_consistency, the incrementally maintained flip counts
+        are compared against a full recompute after every placement.
+        With profile, the rule methods are counted and timed, and the
+        statistics of every game are written to the output directory.
         """
+        if size != self.GRID_NUM:
+            if size < 4 or size % 2:
+                raise ValueError(f'Board size has to be an even number of at least 4, got {size}')
+            self.GRID_NUM = size
+            self.WEIGHTS = weight_table(size)
+            self.WEIGHT_ARRAY = np.array(self.WEIGHTS)
+            self.ZOBRIST_KEYS = zobrist_keys(size)
+            self.RAYS = ray_table(size)
+        self.output = output
         self.verbose = verbose
+        self.check_consistency = check_consistency
+        self.version = 0
+        self.__analysis = None
         self.field = np.zeros(shape=(self.GRID_NUM, self.GRID_NUM))
+        self.flip_counts = {}
+        self.legal_moves = {}
+        self.undo_stack = []
+        self.hash = 0
         self.sequence = []
         self.turn = Player.BLACK
         self.start = Player.BLACK
@@ -32,6 +60,11 @@ class Environment(object):
         self.black_score = 0
         self.white_score = 0
         self.turn_count = 0
+        self.profiler = None
+        if profile:
+            from game.gameplay.profiler import EnvironmentProfiler
+            self.profiler = EnvironmentProfiler(self)
+            self.profiler.enable()
 
     def seed(self, value=42):
         """ 
@@ -41,6 +74,17 @@ class Environment(object):
         random.seed(value)
         np.random.seed(value)
 
+    def _board_changed(self):
+        """ Bump the board version and drop the analysis of the previous board """
+        self.version += 1
+        self.__analysis = None
+
+    def analysis(self):
+        """ Return the PositionAnalysis of the current board, shared until the board changes """
+        if self.__analysis is None:
+            self.__analysis = PositionAnalysis(self)
+        return self.__analysis
+
     def last_move(self):
         if self.sequence is None:
             return None
@@ -48,125 +92,182 @@ class Environment(object):
 
     @property
     def observation_shape(self):
-        # return self.field.size, self.field.size
-        pass
+        """ Shape of the planes written by get_observation """
+        return 4, self.GRID_NUM, self.GRID_NUM
 
     @property
     def num_actions(self):
         """ Get the number of actions the agent can take. """
-        # return len(ALL_SNAKE_ACTION)
-        pass
+        return self.GRID_NUM * self.GRID_NUM
 
-    def __is_opponent_in_valid_direction(self, row, col, direction, player, field=None):
-        """ check if any valid opponent's disk on the path """
+    @staticmethod
+    def __captured_along(ray, own, opp, field):
+        """ return the number of opponent's disks on a ray closed by a disk of own """
+        count = 0
+        for x, y in ray:
+            value = field[x, y]
+            if value != opp:
+                return count if value == own else 0
+            count += 1
+        return 0
+
+    def __disks_to_flip(self, row, col, player, field=None):
+        """ return the coordinates of the opponent's disks captured by a move """
         if field is None:
             field = self.field
-        x = row + direction[0]
-        y = col + direction[1]
-
-        # The first adjacent disk has to be an opponent's disk
-        if self.not_in_grid(x, y) or not self.is_holded_by_opponent(player, x, y, field):
-            return False
-
-        # True if there is a same color disk placed at the end of the path
-        while True:
-            x += direction[0]
-            y += direction[1]
-            if self.not_in_grid(x, y) or self.is_grid_free(x, y, field):
-                return False
-            if self.is_holded_by_player(player, x, y, field):
-                return True
+        own = player.value
+        opp = own % 2 + 1
+
+        flipped = []
+        for ray in self.RAYS[row][col]:
+            count = self.__captured_along(ray, own, opp, field)
+            if count:
+                flipped.extend(ray[:count])
+        return flipped
+
+    def __place_disk(self, row, col, player):
+        """ place player's disk, flip the captured disks and return them """
+        flipped = self.__disks_to_flip(row, col, player)
+        self.field[row][col] = player.value
+        for x, y in flipped:
+            self.field[x][y] = player.value
+        self.__toggle_hash(row, col, player, flipped)
+        self._board_changed()
+        return flipped
+
+    def __toggle_hash(self, row, col, player, flipped):
+        """ xor a placed disk and its flipped disks in or out of the hash """
+        own = self.ZOBRIST_KEYS[player.value]
+        opp = self.ZOBRIST_KEYS[self.getOpponent(player).value]
+        value = self.hash ^ own[row][col]
+        for x, y in flipped:
+            value ^= own[x][y] ^ opp[x][y]
+        self.hash = value
+
+    def position_key(self, player=None):
+        """ Return the Zobrist key of the board with player to move """
+        if player is None:
+            player = self.turn
+        if player == Player.WHITE:
+            return self.hash ^ self.SIDE_KEY
+        return self.hash
 
-    def __flip_disks(self, row, col, player, field=None):
+    def make_move(self, row, col, player):
         """
-        Flip all opponent's disks
-        1. Check all directions, if it is a valid filp,
-        2. place the new disk
-        3. Flip all disks in the path
-        4. Until we find a disk is holded by player
+        Place player's disk in-place and push the flipped disks on the undo
+        stack. The move is not validated and the turn is left unchanged, so
+        a search can walk the tree without copying the board.
         """
-        if field is None:
-            field = self.field
-
-        field[row][col] = int(player.value)
-        for direction in self.DIRECTION:
-            x = row
-            y = col
-
-            if not self.__is_opponent_in_valid_direction(x, y, direction, player):
-                continue
-
-            while True:
-                x += direction[0]
-                y += direction[1]
-
-                if self.is_holded_by_player(player, x, y):
-                    break
-
-                self.__flip_disk(x, y, field)
-
-        return field
+        flipped = self.__place_disk(row, col, player)
+        self.undo_stack.append((row, col, player, flipped))
+        return flipped
+
+    def unmake_move(self):
+        """ Take back the last move made by make_move """
+        row, col, player, flipped = self.undo_stack.pop()
+        opponent = self.getOpponent(player).value
+        self.field[row][col] = Player.NONE.value
+        for x, y in flipped:
+            self.field[x][y] = opponent
+        self.__toggle_hash(row, col, player, flipped)
+        self._board_changed()
 
     def liberty_after_next_steps(self, current_player, target):
         """ return the numbers of liberty of next steps """
         liberty = np.zeros(shape=(self.GRID_NUM, self.GRID_NUM))
         moves = self.possible_moves(current_player)
         for move in moves:
-            field = deepcopy(self.field)
-            field = self.__flip_disks(move[0], move[1], current_player, field)
-            liberty[move[0]][move[1]] = len(self.possible_moves(target, field, True))
+            self.make_move(move[0], move[1], current_player)
+            liberty[move[0]][move[1]] = len(self.possible_moves(target, None, True))
+            self.unmake_move()
         return liberty
 
+    def successor_fields(self, player, moves):
+        """ return a (len(moves), GRID_NUM, GRID_NUM) stack of the boards after each move """
+        fields = np.empty(shape=(len(moves), self.GRID_NUM, self.GRID_NUM))
+        for index, move in enumerate(moves):
+            self.make_move(move[0], move[1], player)
+            fields[index] = self.field
+            self.unmake_move()
+        return fields
+
+    def weighted_scores(self, fields, player):
+        """ return the weighted score of player on every board of a stack """
+        sign = (fields == player.value).astype(int) - (fields == self.getOpponent(player).value)
+        return np.tensordot(sign, self.WEIGHT_ARRAY, axes=2)
+
     def weighted_score_after_next_steps(self, player):
         """ return the total of weighted score """
         scores = np.zeros(shape=(self.GRID_NUM, self.GRID_NUM))
         moves = self.possible_moves(player)
-        for move in moves:
-            score = 0
-            field = deepcopy(self.field)
-            field = self.__flip_disks(move[0], move[1], player, field)
-
-            for col in range(self.GRID_NUM):
-                for row in range(self.GRID_NUM):
-                    if Player(field[row][col]) == player:
-                        score += self.WEIGHTS[row][col]
-                    elif Player(field[row][col]) == self.getOpponent(player):
-                        score -= self.WEIGHTS[row][col]
-            scores[move[0]][move[1]] = score + 1000
+        if not moves:
+            return scores
+
+        rows, cols = np.array(moves).T
+        scores[rows, cols] = self.weighted_scores(self.successor_fields(player, moves), player) + 1000
         return scores
 
     def num_disks_can_filp(self, player, field=None):
         """ return the numbers of disks can be filpped """
+        if field is None and not self.undo_stack:
+            return self.flip_counts[player].copy()
+        return self.__count_all_flips(player, field)
+
+    def __count_all_flips(self, player, field=None):
+        """ count the disks every grid can flip by scanning the whole board """
         if field is None:
             field = self.field
         flip_num = np.zeros(shape=(self.GRID_NUM, self.GRID_NUM))
 
-        for row in range(self.GRID_NUM):
-            for col in range(self.GRID_NUM):
-                for direction in self.DIRECTION:
-                    x = row
-                    y = col
-
-                    if not self.is_grid_free(x, y, field):
-                        continue
-
-                    if not self.__is_opponent_in_valid_direction(x, y, direction, player):
-                        continue
-
-                    while True:
-                        x += direction[0]
-                        y += direction[1]
-
-                        if self.is_holded_by_player(player, x, y):
-                            break
-
-                        flip_num[row][col] += 1
+        for row, col in np.argwhere(field == Player.NONE.value).tolist():
+            flip_num[row, col] = len(self.__disks_to_flip(row, col, player, field))
 
         return flip_num
 
-    def __flip_disk(self, row, col, field):
-        """ flip one disk to opposite color """
-        field[row][col] = self.getOpponent(Player(self.field[row][col])).value
+    def _reset_move_cache(self):
+        """ Recompute the flip counts and legal moves of both players """
+        for player in (Player.BLACK, Player.WHITE):
+            self.flip_counts[player] = self.__count_all_flips(player)
+            self.legal_moves[player] = set(map(tuple, np.argwhere(self.flip_counts[player]).tolist()))
+
+    def __update_move_cache(self, changed):
+        """
+        Update the flip counts and legal moves after the grids in changed
+        were taken. Only empty grids on a line through a changed grid can
+        see a different number of flips.
+        """
+        field = self.field
+        empty = Player.NONE.value
+        affected = set(changed)
+        for row, col in changed:
+            for ray in self.RAYS[row][col]:
+                affected.update(grid for grid in ray if field[grid] == empty)
+
+        for player in (Player.BLACK, Player.WHITE):
+            flip_num = self.flip_counts[player]
+            legal = self.legal_moves[player]
+            for row, col in affected:
+                count = 0
+                if field[row, col] == empty:
+                    count = len(self.__disks_to_flip(row, col, player))
+                flip_num[row][col] = count
+                if count:
+                    legal.add((row, col))
+                else:
+                    legal.discard((row, col))
+
+        if self.check_consistency:
+            self.verify_move_cache()
+
+    def verify_move_cache(self):
+        """ Compare the incremental flip counts against a full recompute """
+        for player in (Player.BLACK, Player.WHITE):
+            expected = self.__count_all_flips(player)
+            if not np.array_equal(expected, self.flip_counts[player]):
+                raise RuntimeError(f'Incremental flip counts of {player} diverged:\n'
+                                   f'{self.flip_counts[player]}\nexpected:\n{expected}')
+            if set(map(tuple, np.argwhere(expected).tolist())) != self.legal_moves[player]:
+                raise RuntimeError(f'Incremental legal moves of {player} diverged')
 
     def is_grid_free(self, row, col, field=None):
         """ check if a grid is available """
@@ -192,44 +293,47 @@ class Environment(object):
 
     def isValidMove(self, row, col, player, field=None):
         """ Check if a move is valid """
+        if field is None and not self.undo_stack:
+            return (row, col) in self.legal_moves[player]
         if field is None:
             field = self.field
-        if self.not_in_grid(row, col) or not self.is_grid_free(row, col, field):
+        if self.not_in_grid(row, col) or field[row, col] != Player.NONE.value:
             return False
 
-        for direction in self.DIRECTION:
-            if self.__is_opponent_in_valid_direction(row, col, direction, player, field):
-                return True
-
-        return False
+        own = player.value
+        opp = own % 2 + 1
+        return any(self.__captured_along(ray, own, opp, field) for ray in self.RAYS[row][col])
 
     def possible_moves(self, player, field=None, verbose=False):
         """ Get all possible of actions the agent can take. """
         if field is None:
-            field = self.field
-        tiles = []
-        size = self.GRID_NUM
-
-        for row in range(size):
-            for col in range(size):
-                if self.isValidMove(row, col, player, field):
-                    tiles.append([row, col])
+            return list(self.analysis().moves(player))
+        return self._generate_moves(player, field)
 
-        return tiles
+    def _generate_moves(self, player, field=None):
+        """ Find the legal moves of player on field, the current board by default """
+        if field is None and not self.undo_stack:
+            return [[row, col] for row, col in sorted(self.legal_moves[player])]
+        if field is None:
+            field = self.field
+        field = np.asarray(field)
+        return [[row, col] for row, col in np.argwhere(field == Player.NONE.value).tolist()
+                if self.isValidMove(row, col, player, field)]
 
     def place_a_disk(self, row, col):
         """ place a disk on the checkboard """
-        if not self.isValidMove(row, col, self.turn):
+        if (row, col) not in self.analysis().legal(self.turn):
             return Event.NOT_VALID_MOVE
 
-        self.__flip_disks(row, col, self.turn, self.field)
+        self._apply_move(row, col, self.turn)
         self.turn_count += 1
         self.sequence.append((row, col))
 
         if self.is_end_game():
-            if self.winning_player() == Player.BLACK:
+            winner = self.winning_player()
+            if winner == Player.BLACK:
                 self.black_score += 1
-            elif self.winning_player() == Player.WHITE:
+            elif winner == Player.WHITE:
                 self.white_score += 1
             return Event.END_GAME
 
@@ -239,53 +343,70 @@ class Environment(object):
 
         return Event.PLACEMENT_SUCCESS
 
+    def _apply_move(self, row, col, player):
+        """ place player's disk on the board and flip the captured disks """
+        flipped = self.__place_disk(row, col, player)
+        self.__update_move_cache([(row, col)] + flipped)
+
     def no_possible_moves(self, player):
         """ Check if player has possible moves """
-        return not self.possible_moves(player)
+        return not self.analysis().moves(player)
 
     def winning_player(self):
         """ Return the winning_player """
-        if self.num_black_disks() > self.num_white_disks():
-            return Player.BLACK
-        elif self.num_black_disks() < self.num_white_disks():
-            return Player.WHITE
-        else:
-            return Player.NONE
+        return self.analysis().winner
 
     def is_end_game(self):
         """ Check if no possible moves for both players """
-        return not self.possible_moves(Player.BLACK) and \
-                not self.possible_moves(Player.WHITE)
+        return self.analysis().end_game
 
     def new_episode(self):
         """ Reset the environment and begin a new episode. """
-        size = self.GRID_NUM
-        self.turn_count = 0
-        self.sequence = []
-
-        # init first four disks
-        self.field = np.zeros(shape=(size, size))
-        self.field[size // 2][size // 2] = Player.WHITE.value
-        self.field[size // 2 - 1][size // 2 - 1] = Player.WHITE.value
-        self.field[size // 2 - 1][size // 2] = Player.BLACK.value
-        self.field[size // 2][size // 2 - 1] = Player.BLACK.value
-
-        self.turn = self.getOpponent(self.start)
         self.start = self.getOpponent(self.start)
+        self.load_position(self.initial_field(), self.start)
 
         return Event.NONE
 
+    def initial_field(self):
+        """ Return the board with the first four disks of a game """
+        size = self.GRID_NUM
+        field = np.zeros(shape=(size, size))
+        field[size // 2][size // 2] = Player.WHITE.value
+        field[size // 2 - 1][size // 2 - 1] = Player.WHITE.value
+        field[size // 2 - 1][size // 2] = Player.BLACK.value
+        field[size // 2][size // 2 - 1] = Player.BLACK.value
+        return field
+
+    def load_position(self, field, turn):
+        """
+        Set up the board and the player to move, e.g. to continue from a
+        snapshot of another environment. The move history is cleared.
+        """
+        self.turn_count = 0
+        self.sequence = []
+        self.undo_stack = []
+        self.field = np.array(field, dtype=float)
+        self.hash = hash_field(self.field, self.ZOBRIST_KEYS)
+        self._board_changed()
+        self._reset_move_cache()
+        self.turn = turn
+
     def isBlackTurn(self):
         """ Check if the current turn is black's turn """
         return Player.BLACK == self.turn
 
     def num_white_disks(self):
         """ Return number of white disks on field """
-        return np.count_nonzero(self.field == int(Player.WHITE.value))
+        return self.analysis().white_disks
 
     def num_black_disks(self):
         """ Return number of black disks on field """
-        return np.count_nonzero(self.field == int(Player.BLACK.value))
+        return self.analysis().black_disks
+
+    def _count_disks(self):
+        """ Count the (black, white) disks on the current board """
+        return (np.count_nonzero(self.field == Player.BLACK.value),
+                np.count_nonzero(self.field == Player.WHITE.value))
 
     def getOpponent(self, player=None):
         """ Return an enum to indicate player's opponent """
@@ -319,13 +440,107 @@ class Environment(object):
             print()
         print()
 
-    def record_timestep_stats(self, result):
-        """ Record environment statistics """
-        pass
+    def record_timestep_stats(self, result, think_time=None):
+        """
+        Record environment statistics of a move: the Event returned by
+        place_a_disk and the seconds the agent took to choose the move.
+        Does nothing unless the environment was created with profile.
+        """
+        if self.profiler is not None:
+            self.profiler.record(result, think_time)
+
+    def get_observation(self, out=None, player=None):
+        """
+        Observe the state of the environment from the view of player (the
+        side to move by default) as four planes: own disks, opponent disks,
+        legal moves, and a plane of ones when player is black. The planes
+        are written into out, a preallocated array of observation_shape.
+        """
+        if player is None:
+            player = self.turn
+        if out is None:
+            out = np.zeros(self.observation_shape, dtype=np.float32)
+        field = self.field
+        np.equal(field, player.value, out=out[0])
+        np.equal(field, self.getOpponent(player).value, out=out[1])
+        legal = out[self.LEGAL_PLANE]
+        if self.undo_stack:
+            legal[:] = 0
+            for row, col in self.possible_moves(player):
+                legal[row, col] = 1
+        else:
+            np.greater(self.flip_counts[player], 0, out=legal)
+        out[3] = player == Player.BLACK
+        return out
+
+
+class PositionAnalysis(object):
+    """
+    The facts about one board that are asked for many times during a ply:
+    the legal moves of both players, the disk counts and the game result.
+    Environment.analysis hands out the same instance until the board
+    changes, and every value is computed on first use only. An analysis
+    kept past a board change still returns the values it has, but refuses
+    to compute new ones from a board it was not made for.
+    """
 
-    def get_observation(self):
-        """ Observe the state of the environment. """
-        pass
+    def __init__(self, env):
+        self.env = env
+        self.version = env.version
+        self.__moves = {}
+        self.__legal = {}
+        self.__disks = None
+
+    def moves(self, player):
+        """ The legal moves of player as a sorted list of [row, col]; do not modify it """
+        moves = self.__moves.get(player)
+        if moves is None:
+            moves = self.__moves[player] = self.__current()._generate_moves(player)
+        return moves
+
+    def legal(self, player):
+        """ The legal moves of player as a set of (row, col) """
+        legal = self.__legal.get(player)
+        if legal is None:
+            legal = self.__legal[player] = set(map(tuple, self.moves(player)))
+        return legal
+
+    @property
+    def disks(self):
+        """ The (black, white) disk counts """
+        if self.__disks is None:
+            self.__disks = self.__current()._count_disks()
+        return self.__disks
+
+    def __current(self):
+        """ Return the environment, checking that its board is still the analysed one """
+        if self.env.version != self.version:
+            raise RuntimeError(f'Position analysis of board version {self.version} used at version '
+                               f'{self.env.version}; ask Environment.analysis() again')
+        return self.env
+
+    @property
+    def black_disks(self):
+        return self.disks[0]
+
+    @property
+    def white_disks(self):
+        return self.disks[1]
+
+    @property
+    def winner(self):
+        """ The player with more disks, Player.NONE on a tie """
+        black, white = self.disks
+        if black > white:
+            return Player.BLACK
+        if black < white:
+            return Player.WHITE
+        return Player.NONE
+
+    @property
+    def end_game(self):
+        """ True when neither player has a legal move """
+        return not self.moves(Player.BLACK) and not self.moves(Player.WHITE)
 
 
 class Player(Enum):
@@ -358,3 +573,19 @@ class Event(Enum):
                 stage == Event.PLACEMENT_SUCCESS or \
                 stage == Event.NOT_VALID_MOVE or \
                 stage == Event.START_NEW_GAME
+
+
+def create_environment(backend="array", **kwargs):
+    """
+    Create a Reversi environment with the requested board backend. The
+    keyword arguments, such as the board size, go to the environment.
+    Returns:
+        An instance of Environment.
+    """
+    if backend == 'array':
+        return Environment(**kwargs)
+    if backend == 'bitboard':
+        from game.gameplay.bitboard import BitboardEnvironment
+        return BitboardEnvironment(**kwargs)
+
+    raise KeyError(f'Unknown environment backend: "{backend}"')
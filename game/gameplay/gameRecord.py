@@ -0,0 +1,192 @@
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from game.gameplay.environment import Environment, Player
+
+
+MAGIC = b"RVGR"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sBBH")
+GAME_HEADER = struct.Struct("<BBBBH")
+
+GameRecord = namedtuple("GameRecord", ["start", "winner", "black_disks", "white_disks", "moves"])
+
+
+def encode_game(env):
+    """
+    Encode the finished game of env: a header with the starting player,
+    winner and disk counts, then one byte (row * GRID_NUM + col) per move.
+    """
+    size = env.GRID_NUM
+    moves = bytes(int(row) * size + int(col) for row, col in env.sequence)
+    header = GAME_HEADER.pack(env.start.value, env.winning_player().value,
+                              env.num_black_disks(), env.num_white_disks(), len(moves))
+    return header + moves
+
+
+class GameRecordWriter(object):
+    """
+    Appends games to a binary archive. Next to the archive, an index file
+    (archive path + ".idx") holds the byte offset of every game so the
+    reader can jump to any game directly.
+    """
+
+    def __init__(self, path, size=None):
+        self.path = path
+        self.size = size or Environment.GRID_NUM
+        if self.size * self.size > 256:
+            raise ValueError(f'Moves of a {self.size}x{self.size} board do not fit in one byte')
+
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            self.size = _repair_index(path)
+        self.file = open(path, "ab")
+        self.index = open(path + ".idx", "ab")
+        if not exists:
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION, self.size, 0))
+        self.offset = self.file.tell()
+
+    def append(self, env):
+        """ Append the finished game of a running environment """
+        if env.GRID_NUM != self.size:
+            raise ValueError(f'Archive stores {self.size}x{self.size} games, got {env.GRID_NUM}x{env.GRID_NUM}')
+        self.write_encoded(encode_game(env))
+
+    def write_encoded(self, data):
+        """ Append one game encoded by encode_game """
+        self.file.write(data)
+        self.index.write(struct.pack("<Q", self.offset))
+        self.offset += len(data)
+
+    def flush(self):
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GameRecordReader(object):
+    """
+    Reads a game archive through a memory map, so games can be streamed or
+    indexed randomly without loading the archive into memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        self.size = _read_file_header(self.data[:FILE_HEADER.size].tobytes())
+
+        index_path = path + ".idx"
+        self.offsets = None
+        if _index_readable(index_path):
+            self.offsets = np.memmap(index_path, dtype="<u8", mode="r")
+        if not self.index_matches_archive():
+            self.offsets = self.build_index()
+
+    def index_matches_archive(self):
+        return _index_matches(self.data, self.offsets)
+
+    def build_index(self):
+        return _build_index(self.data)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        offset = int(self.offsets[index])
+        start, winner, black, white, num_moves = GAME_HEADER.unpack(
+            self.data[offset:offset + GAME_HEADER.size].tobytes())
+        moves = self.data[offset + GAME_HEADER.size:offset + GAME_HEADER.size + num_moves]
+        return GameRecord(Player(start), Player(winner), black, white, moves)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def moves(self, index):
+        """ Return the moves of a game as (row, col) tuples """
+        return [divmod(int(move), self.size) for move in self[index].moves]
+
+    def replay(self, index, env):
+        """ Load the opening position into env and yield it after every move of a game """
+        record = self[index]
+        size = self.size
+        env.load_position(env.initial_field(), record.start)
+        yield env
+        for move in record.moves:
+            env.place_a_disk(*divmod(int(move), size))
+            yield env
+
+    def close(self):
+        del self.data
+        del self.offsets
+
+
+def _read_file_header(data):
+    """ Validate an archive header and return the board size """
+    magic, version, size, _ = FILE_HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a game record archive')
+    return size
+
+
+def _index_readable(index_path):
+    """ Whether an index file exists and holds whole offsets """
+    return os.path.exists(index_path) and os.path.getsize(index_path) > 0 and os.path.getsize(index_path) % 8 == 0
+
+
+def _index_matches(data, offsets):
+    """
+    Check that an index starts at the first game, increases, and that its
+    last game ends exactly at the end of the archive data.
+    """
+    if offsets is None or len(offsets) == 0:
+        return len(data) == FILE_HEADER.size
+    if int(offsets[0]) != FILE_HEADER.size or np.any(np.diff(offsets.astype(np.int64)) <= 0):
+        return False
+    last = int(offsets[-1])
+    if last + GAME_HEADER.size > len(data):
+        return False
+    num_moves = GAME_HEADER.unpack(bytes(data[last:last + GAME_HEADER.size]))[-1]
+    return last + GAME_HEADER.size + num_moves == len(data)
+
+
+def _build_index(data):
+    """ Find the offset of every game by walking the game headers """
+    offsets = []
+    offset = FILE_HEADER.size
+    while offset + GAME_HEADER.size <= len(data):
+        offsets.append(offset)
+        num_moves = GAME_HEADER.unpack(bytes(data[offset:offset + GAME_HEADER.size]))[-1]
+        offset += GAME_HEADER.size + num_moves
+    return np.array(offsets, dtype="<u8")
+
+
+def _repair_index(path):
+    """
+    Rewrite the index file of an existing archive if it does not cover the
+    archive's games, and return the board size of the archive.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    size = _read_file_header(data[:FILE_HEADER.size].tobytes())
+    index_path = path + ".idx"
+    offsets = None
+    if _index_readable(index_path):
+        offsets = np.fromfile(index_path, dtype="<u8")
+    if not _index_matches(data, offsets):
+        _build_index(data).tofile(index_path)
+    del data
+    return size
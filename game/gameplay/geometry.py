@@ -0,0 +1,61 @@
+from functools import lru_cache
+
+from config import EnvConfig
+
+
+DIRECTIONS = ((-1, 0), (-1, 1), (1, 1), (0, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+
+@lru_cache(maxsize=None)
+def ray_table(size):
+    """
+    Return the rays of every grid of a size x size board, indexed as
+    rays[row][col]. A ray lists the (row, col) grids met walking from the
+    grid towards one direction up to the border, nearest first. Rays that
+    leave the board at once are left out, so walking a ray needs no bounds
+    checks.
+    """
+    rays = []
+    for row in range(size):
+        rays.append([])
+        for col in range(size):
+            grid_rays = []
+            for dr, dc in DIRECTIONS:
+                ray = []
+                x, y = row + dr, col + dc
+                while 0 <= x < size and 0 <= y < size:
+                    ray.append((x, y))
+                    x, y = x + dr, y + dc
+                if ray:
+                    grid_rays.append(tuple(ray))
+            rays[-1].append(tuple(grid_rays))
+    return rays
+
+
+@lru_cache(maxsize=None)
+def weight_table(size):
+    """
+    Return the positional weights of a size x size board. The 8x8 board
+    uses EnvConfig.GRID_WEIGHT_8x8; other sizes get the same pattern
+    stretched to their border: corners are best, the grids next to a
+    corner are worst, and the inner grids are nearly neutral.
+    """
+    if size == 8:
+        return EnvConfig.GRID_WEIGHT_8x8
+
+    weights = []
+    for row in range(size):
+        weights.append([])
+        for col in range(size):
+            # Distances of the grid to its nearest borders, smaller first
+            near, far = sorted((min(row, size - 1 - row), min(col, size - 1 - col)))
+            if near == 0:
+                weight = {0: 120, 1: -20, 2: 20}.get(far, 5)
+            elif near == 1:
+                weight = -40 if far == 1 else -5
+            elif near == 2:
+                weight = 15 if far == 2 else 3
+            else:
+                weight = 3
+            weights[-1].append(weight)
+    return weights
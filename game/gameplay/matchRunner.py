@@ -0,0 +1,170 @@
+import multiprocessing
+import random
+import time
+
+import numpy as np
+
+from config import EnvConfig
+from game.agent import create_agent
+from game.gameplay.environment import Event, Player, create_environment
+from game.gameplay.gameRecord import GameRecordWriter, encode_game
+from game.learning.inferenceServer import dqn_inference
+
+
+class MatchResult(object):
+    """ Accumulates the outcome of headless agent-vs-agent games. """
+
+    def __init__(self):
+        self.games = 0
+        self.black_score = 0
+        self.white_score = 0
+        self.draws = 0
+        self.disk_differential = 0
+        self.elapsed = 0.0
+        self.records = []
+
+    def record(self, env, keep_game=False):
+        """ Record the final position of a finished game """
+        if keep_game:
+            self.records.append(encode_game(env))
+        winner = env.winning_player()
+        if winner == Player.BLACK:
+            self.black_score += 1
+        elif winner == Player.WHITE:
+            self.white_score += 1
+        else:
+            self.draws += 1
+        self.disk_differential += env.num_black_disks() - env.num_white_disks()
+        self.games += 1
+
+    def merge(self, other):
+        """ Add the games of another result to this one """
+        self.games += other.games
+        self.black_score += other.black_score
+        self.white_score += other.white_score
+        self.draws += other.draws
+        self.disk_differential += other.disk_differential
+
+    @property
+    def games_per_second(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return self.games / self.elapsed
+
+    def summary(self, agent1, agent2):
+        """ Return a printable report of the match """
+        games = max(self.games, 1)
+        return "\n".join([
+            f"{self.games} games in {self.elapsed:.2f}s ({self.games_per_second:.1f} games/s)",
+            f"  {agent1} (black) wins: {self.black_score} ({100 * self.black_score / games:.1f}%)",
+            f"  {agent2} (white) wins: {self.white_score} ({100 * self.white_score / games:.1f}%)",
+            f"  draws: {self.draws} ({100 * self.draws / games:.1f}%)",
+            f"  mean disk differential (black - white): {self.disk_differential / games:+.2f}",
+        ])
+
+
+def play_episode(env, agents):
+    """ Play one game to the end without rendering or delays """
+    clock = time.perf_counter
+    while True:
+        start_time = clock()
+        move = agents[env.turn].act()
+        think_time = clock() - start_time
+        event = env.place_a_disk(move[0], move[1])
+        env.record_timestep_stats(event, think_time)
+        if event == Event.END_GAME:
+            return event
+        if event == Event.NOT_VALID_MOVE:
+            raise ValueError(f'{agents[env.turn].name} agent played an invalid move {move}')
+
+
+def play_matches(agent1, agent2, num_episodes, backend="array", seed=None, endgame_empties=0,
+                 keep_games=False, profile_output=None, size=EnvConfig.DIMENSION_OF_GRID, inference=None):
+    """
+    Play num_episodes games on size x size boards in the current process.
+    With profile_output, the statistics of every game are written to that
+    directory. inference is passed on to create_agent.
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+    if profile_output is not None:
+        env = create_environment(backend, output=profile_output, profile=True, size=size)
+    else:
+        env = create_environment(backend, size=size)
+    agents = {}
+    agents[Player.BLACK] = create_agent(agent1, env, endgame_empties, inference)
+    agents[Player.WHITE] = create_agent(agent2, env, endgame_empties, inference)
+
+    result = MatchResult()
+    try:
+        for episode in range(num_episodes):
+            play_episode(env, agents)
+            result.record(env, keep_games)
+            env.new_episode()
+    finally:
+        for agent in agents.values():
+            agent.close()
+    return result
+
+
+def _play_chunk(args):
+    return play_matches(*args)
+
+
+def run_matches(agent1, agent2, num_episodes, backend="array", num_workers=None, seed=0,
+                endgame_empties=0, record_path=None, profile_output=None, size=EnvConfig.DIMENSION_OF_GRID,
+                inference_server=False):
+    """
+    Play num_episodes agent-vs-agent games spread over a process pool.
+    agent1 plays black and agent2 plays white; the starting player
+    alternates between games as in Environment.new_episode. With
+    record_path, every game is appended to that game record archive, and
+    with profile_output every process writes its game statistics there.
+    With inference_server, the dqn agents of all processes share one
+    InferenceServer instead of each loading the network.
+    """
+    if 'human' in (agent1, agent2):
+        raise ValueError('Human agents cannot play in headless mode')
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+
+    # Even chunks keep the number of games started by each colour balanced
+    chunk = max(2, num_episodes // (num_workers * 8))
+    chunk += chunk % 2
+    sizes = [chunk] * (num_episodes // chunk)
+    if num_episodes % chunk:
+        sizes.append(num_episodes % chunk)
+    writer = None
+    if record_path is not None:
+        writer = GameRecordWriter(record_path, size)
+        if writer.size != size:
+            writer.close()
+            raise ValueError(f'Archive stores {writer.size}x{writer.size} games, got {size}x{size}')
+
+    result = MatchResult()
+    start_time = time.perf_counter()
+    try:
+        with dqn_inference((agent1, agent2), inference_server, size) as inference:
+            jobs = [(agent1, agent2, games, backend, seed + index, endgame_empties, record_path is not None,
+                     profile_output, size, inference) for index, games in enumerate(sizes)]
+            if num_workers == 1:
+                for chunk_result in map(_play_chunk, jobs):
+                    _merge_chunk(result, chunk_result, writer)
+            else:
+                with multiprocessing.Pool(num_workers) as pool:
+                    for chunk_result in pool.imap_unordered(_play_chunk, jobs):
+                        _merge_chunk(result, chunk_result, writer)
+    finally:
+        if writer is not None:
+            writer.close()
+    result.elapsed = time.perf_counter() - start_time
+    return result
+
+
+def _merge_chunk(result, chunk_result, writer):
+    result.merge(chunk_result)
+    if writer is not None:
+        for data in chunk_result.records:
+            writer.write_encoded(data)
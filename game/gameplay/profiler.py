@@ -0,0 +1,161 @@
+import csv
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+
+from config import EnvConfig
+from game.gameplay.environment import Event
+
+
+class EnvironmentProfiler(object):
+    """
+    Counts the calls and cumulative time of the rule methods of one
+    environment, together with the moves, passes and agent think time of
+    every game. The rule methods are wrapped on the instance only, so an
+    environment without a profiler runs the plain class methods. Times are
+    inclusive: a method calling another profiled method counts its time too.
+    Further environments, such as the copy agents search on, can be
+    attached so their rule methods count towards the same game.
+    """
+
+    METHODS = ['place_a_disk', 'possible_moves', 'isValidMove', 'num_disks_can_filp',
+               'liberty_after_next_steps', 'weighted_score_after_next_steps',
+               'no_possible_moves', 'is_end_game', 'make_move', 'unmake_move']
+
+    def __init__(self, env, history=EnvConfig.PROFILE_HISTORY, export_format=EnvConfig.PROFILE_FORMAT):
+        if export_format not in ('json', 'csv'):
+            raise ValueError(f'Unknown profile export format: "{export_format}"')
+        self.env = env
+        self.export_format = export_format
+        self.counters = {name: [0, 0.0] for name in self.METHODS}
+        self.episodes = deque(maxlen=history)
+        self.episode = 0
+        self.moves = 0
+        self.passes = 0
+        self.think_times = []
+        self.attached = []
+        self.enabled = False
+
+    def enable(self):
+        """ Wrap the rule methods of the environment with counting timers """
+        if self.enabled:
+            return
+        for env in [self.env] + self.attached:
+            self.__wrap(env)
+        self.enabled = True
+
+    def disable(self):
+        """ Restore the plain methods of the environment """
+        for env in [self.env] + self.attached:
+            for name in self.METHODS:
+                env.__dict__.pop(name, None)
+        self.enabled = False
+
+    def attach(self, env):
+        """ Also count the rule methods of another environment """
+        if env is self.env or env in self.attached:
+            return
+        self.attached.append(env)
+        if self.enabled:
+            self.__wrap(env)
+
+    def __wrap(self, env):
+        for name in self.METHODS:
+            setattr(env, name, self.__timed(getattr(env, name), self.counters[name]))
+
+    def __timed(self, method, counter):
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start_time = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                counter[0] += 1
+                counter[1] += clock() - start_time
+        return timed
+
+    def record(self, event, think_time=None):
+        """ Record the outcome of one move and the time the agent took to choose it """
+        if event == Event.NOT_VALID_MOVE:
+            return
+        self.moves += 1
+        if think_time is not None:
+            self.think_times.append(think_time)
+        if event == Event.NO_POSSIBLE_MOVES:
+            self.passes += 1
+        elif event == Event.END_GAME:
+            self.end_episode()
+
+    def snapshot(self):
+        """ Return the numbers of the running game """
+        think = self.think_times
+        return {
+            'episode': self.episode,
+            'moves': self.moves,
+            'passes': self.passes,
+            'think_time_mean': sum(think) / len(think) if think else 0.0,
+            'think_time_max': max(think) if think else 0.0,
+            'methods': {name: {'calls': calls, 'time': seconds}
+                        for name, (calls, seconds) in self.counters.items()},
+        }
+
+    def end_episode(self):
+        """ Close the running game, add it to the history and append it to the stats file """
+        stats = self.snapshot()
+        self.episodes.append(stats)
+        self.append(stats)
+        self.episode += 1
+        self.moves = 0
+        self.passes = 0
+        self.think_times = []
+        for counter in self.counters.values():
+            counter[0], counter[1] = 0, 0.0
+
+    @property
+    def path(self):
+        name = 'timestep_stats'
+        process = multiprocessing.current_process()
+        if process.name != 'MainProcess':
+            name += f'-{process.name}'
+        extension = 'jsonl' if self.export_format == 'json' else 'csv'
+        return os.path.join(self.env.output, f'{name}.{extension}')
+
+    @staticmethod
+    def flatten(stats):
+        """ Return the stats of a game as one flat dict """
+        row = {key: value for key, value in stats.items() if key != 'methods'}
+        for name, method in stats['methods'].items():
+            row[f'{name}_calls'] = method['calls']
+            row[f'{name}_time'] = method['time']
+        return row
+
+    def append(self, stats):
+        """ Append the stats of one game to the stats file: a JSON line or a CSV row """
+        path = self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if self.export_format == 'json':
+            with open(path, 'a') as file:
+                file.write(json.dumps(stats) + '\n')
+        else:
+            row = self.flatten(stats)
+            new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+            with open(path, 'a', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=list(row))
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+
+    def export(self, path):
+        """ Write all games of the history to a JSON or CSV file """
+        if self.export_format == 'json':
+            with open(path, 'w') as file:
+                json.dump(list(self.episodes), file, indent=1)
+        else:
+            rows = [self.flatten(stats) for stats in self.episodes]
+            with open(path, 'w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=list(rows[0]) if rows else [])
+                writer.writeheader()
+                writer.writerows(rows)
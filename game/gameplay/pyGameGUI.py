@@ -3,6 +3,8 @@ import textwrap
 import pygame
 import pdb
 import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from game.gameplay.environment import Environment, Event, Player
 from pygame.draw import polygon as DrawPolygon
@@ -22,19 +24,40 @@ class PyGameGUI:
     TIMESTEP_DELAY = GUIConfig.TIMESTEP_DELAY
     END_GAME_DELAY = GUIConfig.END_GAME_DELAY
     END_GAME_VIEW_DELAY = GUIConfig.END_GAME_VIEW_DELAY
-
-    def __init__(self, env, agents):
+    STATS_HEIGHT = GUIConfig.STATS_PANEL_HEIGHT
+    TURBO_RENDER_EVERY = GUIConfig.TURBO_RENDER_EVERY
+    TURBO_SLICE = GUIConfig.TURBO_SLICE
+
+    def __init__(self, env, agents, agent_env=None):
+        """
+        Create the GUI for env. The AI agents should act on agent_env, a
+        separate environment that is loaded with the position of env
+        before they think; they then think in a background thread while
+        the window keeps rendering. Agents created on env itself act
+        synchronously in the render loop.
+        """
         print("pygame init")
 
         self.env = env
         self.agents = agents
+        self.agent_env = agent_env
+        self.executor = ThreadPoolExecutor(max_workers=1) if agent_env is not None else None
+        self.pending = None
+        self.pondering = None
+        self.think_start = 0
+        self.turbo = False
+        self.turbo_level = 0
         self.fps_clock = None
         self.event = Event.NONE
         self.choice = (-1, -1)
         self.markerPos = (-1, -1)
+        self.think_time = None
         self.timestep_watch = Stopwatch()
+        self.show_stats = env.profiler is not None
         self.width = (self.CELL_WIDTH + self.MARGIN) * self.env.GRID_NUM + self.MARGIN
         self.height = self.width + self.PANEL_HEIGHT
+        if self.show_stats:
+            self.height += self.STATS_HEIGHT
 
         windowSize = [self.width, self.height]
         ico_img = pygame.image.load("logo.png")
@@ -45,10 +68,46 @@ class PyGameGUI:
         pygame.display.set_icon(ico_img)
         pygame.display.set_caption("Reversi")
         self.screen = pygame.display.set_mode(windowSize)
+        self.load_assets()
+        self.invalidate()
+
+    def load_assets(self):
+        """ Create the fonts and pre-render the cell and marker surfaces once """
+        size = self.CELL_WIDTH
+        margin = self.MARGIN
+        radius = (size - 2 * margin) // 2
+
+        pygame.font.init()
+        self.panel_font = pygame.font.SysFont('Comic Sans MS', 16)
+        self.message_font = pygame.font.SysFont('Comic Sans MS', 24)
+        self.stats_font = pygame.font.SysFont('Comic Sans MS', 12)
+
+        self.cell_surfaces = {}
+        for value, color in ((Player.NONE.value, None), (Player.WHITE.value, Colors.WHITE),
+                             (Player.BLACK.value, Colors.BLACK)):
+            surface = pygame.Surface((size, size))
+            surface.fill(Colors.GREEN)
+            if color is not None:
+                DrawCircle(surface, color, (size // 2, size // 2), radius)
+            self.cell_surfaces[value] = surface
+
+        self.marker_surfaces = {}
+        for color in (Colors.BLUE, Colors.RED, Colors.YELLOW):
+            surface = pygame.Surface((size, size), pygame.SRCALPHA)
+            self.render_marker(surface, color)
+            self.marker_surfaces[color] = surface
+
+    def invalidate(self):
+        """ Forget what is on the screen so the next frame is drawn in full """
+        self.full_redraw = True
+        self.drawn_cells = {}
+        self.drawn_panel = None
+        self.drawn_message = None
 
     def load_environment(self, env):
         """ Load the Environment agent into the GUI. """
         self.env = env
+        self.invalidate()
 
     def load_agents(self, agents):
         """ Load the RL agent into the GUI. """
@@ -74,22 +133,36 @@ class PyGameGUI:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     raise QuitRequestedError
+                if event.key == pygame.K_t:
+                    self.set_turbo(not self.turbo, self.turbo_level)
+                if event.key in (pygame.K_UP, pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                    self.set_turbo(True, self.turbo_level + 1 if self.turbo else 0)
+                if event.key in (pygame.K_DOWN, pygame.K_MINUS, pygame.K_KP_MINUS):
+                    self.set_turbo(self.turbo_level > 0, self.turbo_level - 1)
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if Event.is_valid_placement_stage(self.event):
                     self.choice = self.get_mouse_coordinate()
                 self.event = Event.next(self.event)
                 self.timestep_watch.reset()
 
-                liberties = self.env.liberty_after_next_steps(self.env.turn, self.env.getOpponent())
-                self.env.printField(liberties)
-                print()
-                # self.env.printFlipNum(self.env.turn)
-                # print(self.env.update_num_disks_can_filp(self.choice[0], self.choice[1], self.env.turn))
-
             # print("Click ", pos, "coordinates: ", row, col)
 
+    def set_turbo(self, turbo, level=0):
+        """
+        Switch turbo spectator mode on or off. In turbo mode AI moves are
+        played without delays or frame limit and a frame is drawn every
+        TURBO_RENDER_EVERY[level] moves (0: only final positions).
+        """
+        self.turbo = turbo
+        self.turbo_level = min(max(level, 0), len(self.TURBO_RENDER_EVERY) - 1)
+        caption = "Reversi"
+        if turbo:
+            every = self.TURBO_RENDER_EVERY[self.turbo_level]
+            caption += f" - turbo, drawing {'final positions' if every == 0 else f'every {every} moves'}"
+        pygame.display.set_caption(caption)
+
     def render_panel(self):
-        """ Draw game info at the top """
+        """ Draw game info at the top and return the area drawn """
         size = self.env.GRID_NUM
         panel = self.PANEL_HEIGHT
         margin = self.MARGIN
@@ -102,8 +175,9 @@ class PyGameGUI:
         y = margin
         w = (cellWidth + margin) * (self.env.GRID_NUM // 2) - margin
         h = panel - margin
-        screenWidth = (cellWidth + margin) * size + margin
+        area = pygame.Rect(0, 0, self.width, panel)
 
+        DrawRect(screen, Colors.BLACK, area)
         DrawRect(screen, Colors.GRAY, [x_left, y, w, h])
         DrawRect(screen, Colors.GRAY, [x_right, y, w, h])
         DrawCircle(screen, Colors.BLACK, (x_left + margin + radius, margin + h // 2), radius)
@@ -120,135 +194,265 @@ class PyGameGUI:
         black_ai = self.agents[Player.BLACK].name
         white_ai = self.agents[Player.WHITE].name
 
-        pygame.font.init()
-        self.font = pygame.font.SysFont('Comic Sans MS', 16)
-
-        text = self.font.render(f'{black_ai} ({black_score}) {black_disks}', False, (255, 255, 255))
+        text = self.panel_font.render(f'{black_ai} ({black_score}) {black_disks}', False, (255, 255, 255))
         text_rect = text.get_rect(midleft=(x_left + 2 * (margin + radius), panel // 2))
         self.screen.blit(text, text_rect)
 
-        text = self.font.render(f'{white_ai} ({white_score}) {white_disks}', False, (255, 255, 255))
+        text = self.panel_font.render(f'{white_ai} ({white_score}) {white_disks}', False, (255, 255, 255))
         text_rect = text.get_rect(midleft=(x_right + 2 * (margin + radius), panel // 2))
         self.screen.blit(text, (x_right + 2 * (margin + radius), panel // 2 - 10))
-
-    def render_marker(self, makerPos, color):
-        """ Draw a marker on the current focused grid """
-        if makerPos is None:
-            return
-
-        screen = self.screen
-        margin = self.MARGIN
+        return area
+
+    def render_stats(self):
+        """ Draw the live profiler numbers of the running game at the bottom and return the area drawn """
+        stats = self.env.profiler.snapshot()
+        methods = sorted(stats['methods'].items(), key=lambda item: -item[1]['time'])[:4]
+        lines = [f"game {stats['episode']}  moves {stats['moves']}  passes {stats['passes']}  "
+                 f"think {1000 * stats['think_time_mean']:.1f}/{1000 * stats['think_time_max']:.1f} ms"]
+        for index in range(0, len(methods), 2):
+            lines.append("  ".join(f"{name} {method['calls']}x {1000 * method['time']:.1f}ms"
+                                   for name, method in methods[index:index + 2]))
+
+        y = self.width + self.PANEL_HEIGHT
+        area = pygame.Rect(0, y, self.width, self.STATS_HEIGHT)
+        DrawRect(self.screen, Colors.BLACK, area)
+        line_height = self.STATS_HEIGHT // 3
+        for line in lines:
+            text = self.stats_font.render(line, False, Colors.WHITE)
+            self.screen.blit(text, (self.MARGIN, y))
+            y += line_height
+        return area
+
+    def render_marker(self, surface, color):
+        """ Draw the corner brackets of a marker on a cell-sized surface """
         size = self.CELL_WIDTH
-        panel = self.PANEL_HEIGHT
-
         width = 4
-        row = makerPos[0]
-        col = makerPos[1]
         length = size // 3
-        x = (margin + size) * row + margin
-        y = (margin + size) * col + margin + panel
-
-        DrawRect(screen, color, [x, y, length, width])
-        DrawRect(screen, color, [x, y, width, length])
-        DrawRect(screen, color, [x + size - length, y, length, width])
-        DrawRect(screen, color, [x + size - width, y, width, length])
-        DrawRect(screen, color, [x, y + size - width, length, width])
-        DrawRect(screen, color, [x, y + size - length, width, length])
-        DrawRect(screen, color, [x + size - width, y + size - length, width, length])
-        DrawRect(screen, color, [x + size - length, y + size - width, length, width])
-
-    def render_possible_moves(self):
-        """ Draw markers possible moves on grids """
-        for move in self.env.possible_moves(self.env.turn):
-            self.render_marker(move, Colors.BLUE)
-
-    def render_cell(self, row, col):
-        """ Draw the cell specified by the field coordinates. """
-        env = self.env
+        x = y = 0
+
+        DrawRect(surface, color, [x, y, length, width])
+        DrawRect(surface, color, [x, y, width, length])
+        DrawRect(surface, color, [x + size - length, y, length, width])
+        DrawRect(surface, color, [x + size - width, y, width, length])
+        DrawRect(surface, color, [x, y + size - width, length, width])
+        DrawRect(surface, color, [x, y + size - length, width, length])
+        DrawRect(surface, color, [x + size - width, y + size - length, width, length])
+        DrawRect(surface, color, [x + size - length, y + size - width, length, width])
+
+    def current_legal_moves(self):
+        """ Return the legal moves of the side to move from the analysis of the current board """
+        return self.env.analysis().legal(self.env.turn)
+
+    def render_cell(self, row, col, value, marker):
+        """ Draw the cell specified by the field coordinates and return its area. """
         size = self.CELL_WIDTH
-        panel = self.PANEL_HEIGHT
         margin = self.MARGIN
-        screen = self.screen
 
-        radius = (size - 2 * margin) // 2
         cellX = (margin + size) * row + margin
-        celly = (margin + size) * col + margin + panel
-        diskX = margin + size // 2 + row * (size + margin)
-        diskY = margin + size // 2 + col * (size + margin) + panel
-
-        DrawRect(screen, Colors.GREEN, [cellX, celly, size, size])
-        if env.isWhite(row, col):
-            DrawCircle(screen, Colors.WHITE, (diskX, diskY), radius)
-        if env.isBlack(row, col):
-            DrawCircle(screen, Colors.BLACK, (diskX, diskY), radius)
-
-    def render_messages(self, msg):
-        """ Draw a message on game screen """
-
+        cellY = (margin + size) * col + margin + self.PANEL_HEIGHT
+        self.screen.blit(self.cell_surfaces[value], (cellX, cellY))
+        if marker is not None:
+            self.screen.blit(self.marker_surfaces[marker], (cellX, cellY))
+        return pygame.Rect(cellX, cellY, size, size)
+
+    def message_area(self):
+        """ Return the area covered by the message box """
         x = self.MARGIN + self.CELL_WIDTH
         y = self.height // 3
         w = self.width - 2 * (self.MARGIN + self.CELL_WIDTH)
         h = self.height // 3
+        return pygame.Rect(x - self.MARGIN, y - self.MARGIN, w + 2 * self.MARGIN, h + 2 * self.MARGIN)
 
-        DrawRect(self.screen, Colors.DARK_BLUE, [x - self.MARGIN, y - self.MARGIN, w + 2 * self.MARGIN, h + 2 * self.MARGIN])
-        DrawRect(self.screen, Colors.BLUE, [x, y, w, h])
-
-        pygame.font.init()
-        self.font = pygame.font.SysFont('Comic Sans MS', 24)
+    def render_messages(self, msg):
+        """ Draw a message on game screen and return its area """
+        area = self.message_area()
+        DrawRect(self.screen, Colors.DARK_BLUE, area)
+        DrawRect(self.screen, Colors.BLUE, area.inflate(-2 * self.MARGIN, -2 * self.MARGIN))
 
-        text = self.font.render(msg, False, Colors.WHITE)
+        text = self.message_font.render(msg, False, Colors.WHITE)
         text_rect = text.get_rect(center=(self.width // 2, self.height // 2))
         self.screen.blit(text, text_rect)
+        return area
 
-    def render(self):
-        """ Draw the entire game frame. """
-        self.screen.fill(Colors.BLACK)
-        any_human_agents = isinstance(self.agents[Player.WHITE], HumanAgent) or \
-                            isinstance(self.agents[Player.BLACK], HumanAgent)
-
-        for col in range(self.env.GRID_NUM):
-            for row in range(self.env.GRID_NUM):
-                self.render_cell(row, col)
-
-        self.render_panel()
-        self.render_possible_moves()
-        if self.env.turn_count > 0:
-            self.render_marker(self.env.last_move(), Colors.RED)
-        if any_human_agents:
-            self.render_marker(self.markerPos, Colors.YELLOW)
-
+    def current_message(self):
+        """ Return the message to show over the board, if any """
         if self.event == Event.NO_POSSIBLE_MOVES:
-            self.render_messages("No Possible Moves")
-
+            return "No Possible Moves"
         if self.event == Event.END_GAME:
-            if self.env.winning_player() == Player.BLACK:
-                msg = "Black wins"
-            elif self.env.winning_player() == Player.WHITE:
-                msg = "White wins"
-            else:
-                msg = "Draw"
-            self.render_messages(msg)
+            winner = self.env.winning_player()
+            if winner == Player.BLACK:
+                return "Black wins"
+            if winner == Player.WHITE:
+                return "White wins"
+            return "Draw"
+        return None
 
-        self.pygame_clock.tick(60)
-        pygame.display.flip()
+    def render(self):
+        """
+        Draw the parts of the frame that changed since the last frame and
+        push only those areas to the display. The board is drawn from a
+        snapshot of the field taken at the start of the frame.
+        """
+        env = self.env
+        field = numpy.array(env.field)
+        any_human_agents = isinstance(self.agents[Player.WHITE], HumanAgent) or \
+                            isinstance(self.agents[Player.BLACK], HumanAgent)
+        dirty = []
+        if self.full_redraw:
+            self.screen.fill(Colors.BLACK)
+            dirty.append(self.screen.get_rect())
+            self.full_redraw = False
+
+        message = self.current_message()
+        if message != self.drawn_message:
+            # The message box covers cells, so they are all drawn again
+            if self.drawn_message is not None:
+                dirty.append(DrawRect(self.screen, Colors.BLACK, self.message_area()))
+            self.drawn_cells.clear()
+
+        legal = self.current_legal_moves()
+        last = tuple(env.last_move()) if env.turn_count > 0 else None
+        mouse = tuple(self.markerPos) if any_human_agents else None
+        drawn_cells = self.drawn_cells
+        for col in range(env.GRID_NUM):
+            for row in range(env.GRID_NUM):
+                cell = (row, col)
+                if cell == mouse:
+                    marker = Colors.YELLOW
+                elif cell == last:
+                    marker = Colors.RED
+                elif cell in legal:
+                    marker = Colors.BLUE
+                else:
+                    marker = None
+                state = (field[row][col], marker)
+                if drawn_cells.get(cell) != state:
+                    dirty.append(self.render_cell(row, col, field[row][col], marker))
+                    drawn_cells[cell] = state
+
+        panel = (self.agents[Player.BLACK].name, self.agents[Player.WHITE].name, env.black_score,
+                 env.white_score, env.num_black_disks(), env.num_white_disks(), env.isBlackTurn())
+        if panel != self.drawn_panel:
+            dirty.append(self.render_panel())
+            self.drawn_panel = panel
+        if self.show_stats:
+            dirty.append(self.render_stats())
+
+        if message is not None and (dirty or message != self.drawn_message):
+            dirty.append(self.render_messages(message))
+        self.drawn_message = message
+
+        self.pygame_clock.tick(0 if self.turbo else self.FPS_LIMIT)
+        if dirty:
+            pygame.display.update(dirty)
 
     def place_a_disk(self):
         """ place a disk on the checkboard """
         if Event.is_valid_placement_stage(self.event):
+            # Mirror the move on an idle agent environment instead of reloading it later
+            mirror = self.agent_env is not None and self.pending is None and \
+                self.agent_env.position_key() == self.env.position_key()
             self.event = self.env.place_a_disk(self.choice[0], self.choice[1])
+            if self.event != Event.NOT_VALID_MOVE:
+                if mirror:
+                    self.agent_env.place_a_disk(self.choice[0], self.choice[1])
+                self.env.record_timestep_stats(self.event, self.think_time)
+                self.think_time = None
+
+    def submit(self, work):
+        """ Run work in the agent thread, or right away when there is no agent environment """
+        if self.executor is not None:
+            return self.executor.submit(work)
+        future = Future()
+        future.set_result(work())
+        return future
+
+    def sync_agent_env(self):
+        """ Load the position on the board into the environment of the agents """
+        if self.agent_env is not None and self.agent_env.position_key() != self.env.position_key():
+            self.agent_env.load_position(self.env.field, self.env.turn)
+
+    def start_pondering(self):
+        """ Let the AI opponent of a human think while the human chooses a move """
+        if self.executor is None or self.pending is not None:
+            return
+        opponent = self.agents[self.env.getOpponent(self.env.turn)]
+        if isinstance(opponent, HumanAgent):
+            return
+        self.sync_agent_env()
+        self.pondering = opponent
+        # Cleared here, so a stop() that arrives before the thread runs ponder() is kept
+        opponent.clear_stop()
+        self.pending = self.executor.submit(opponent.ponder)
+
+    def stop_pondering(self):
+        """ Stop a pondering agent and wait until it has left the agent environment """
+        if self.pondering is not None:
+            self.pondering.stop()
+            self.pending.result()
+            self.pondering = None
+            self.pending = None
+
+    def stop_agents(self):
+        """ Stop any agent work in the background and shut the agent thread down """
+        for agent in self.agents.values():
+            agent.stop()
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+        self.pondering = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
 
     def ai_event(self):
-        """ ai picks an action """ 
+        """
+        Let the ai pick an action without blocking the render loop: start
+        the agent once the timestep delay has passed, then poll its pending
+        move every frame.
+        """
         self.choice = (-1, -1)
         any_human_agents = isinstance(self.agents[Player.WHITE], HumanAgent) or \
                             isinstance(self.agents[Player.BLACK], HumanAgent)
+        self.stop_pondering()
 
-        if self.timestep_watch.time() >= self.TIMESTEP_DELAY:
+        if self.pending is None:
+            if self.timestep_watch.time() >= self.TIMESTEP_DELAY:
+                self.timestep_watch.reset()
+                if not any_human_agents:
+                    self.event = Event.next(self.event)
+                if Event.is_valid_placement_stage(self.event):
+                    self.sync_agent_env()
+                    self.think_start = time.perf_counter()
+                    self.pending = self.submit(self.agents[self.env.turn].act)
+
+        if self.pending is not None and self.pending.done():
+            self.choice = self.pending.result()
+            self.think_time = time.perf_counter() - self.think_start
+            self.pending = None
             self.timestep_watch.reset()
-            if not any_human_agents:
-                self.event = Event.next(self.event)
-            if Event.is_valid_placement_stage(self.event):
-                self.choice = self.agents[self.env.turn].act()
+
+    def play_turbo(self):
+        """
+        Play AI moves synchronously and without delays until the frame is
+        due (TURBO_RENDER_EVERY moves or TURBO_SLICE milliseconds), a human
+        is to move, or the game ends.
+        """
+        every = self.TURBO_RENDER_EVERY[self.turbo_level]
+        deadline = time.perf_counter() + self.TURBO_SLICE / 1000
+        played = 0
+        while not isinstance(self.agents[self.env.turn], HumanAgent):
+            self.sync_agent_env()
+            start_time = time.perf_counter()
+            self.choice = self.agents[self.env.turn].act()
+            self.think_time = time.perf_counter() - start_time
+            self.event = Event.NONE
+            self.place_a_disk()
+            if self.event == Event.NOT_VALID_MOVE:
+                raise ValueError(f'{self.agents[self.env.turn].name} agent played an invalid move {self.choice}')
+            played += 1
+            if self.event == Event.END_GAME or played == every or time.perf_counter() > deadline:
+                break
+        return every != 0 or self.event == Event.END_GAME
 
     def run_episode(self):
         """ Run the GUI player for a single episode. """
@@ -260,9 +464,18 @@ class PyGameGUI:
             # handle exit event
             self.handle_input_event()
 
+            if self.turbo and not is_human_agent and self.pending is None:
+                if self.play_turbo():
+                    self.render()
+                if self.event == Event.END_GAME:
+                    self.event = Event.END_GAME_VIEW
+                    break
+                continue
+
             # pick the next action
             if is_human_agent:
                 self.handle_input_event()
+                self.start_pondering()
             else:
                 self.ai_event()
             self.place_a_disk()
@@ -275,9 +488,14 @@ class PyGameGUI:
                 pygame.time.wait(self.END_GAME_VIEW_DELAY)
                 break
 
-    def run(self, num_episodes=1):
-        """ Run the GUI player for the specified number of episodes. """
-        pygame.display.update()
+    def run(self, num_episodes=1, turbo=False):
+        """
+        Run the GUI player for the specified number of episodes. Press T to
+        toggle turbo spectator mode and the up/down (or +/-) keys to draw
+        fewer or more of its moves.
+        """
+        self.invalidate()
+        self.set_turbo(turbo)
         self.fps_clock = pygame.time.Clock()
 
         try:
@@ -287,6 +505,8 @@ class PyGameGUI:
                 self.event = Event.next(self.event)
         except QuitRequestedError:
             print("Exit Program")
+        finally:
+            self.stop_agents()
 
         pygame.quit()        
 
@@ -0,0 +1,258 @@
+import json
+import math
+import multiprocessing
+import sqlite3
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from config import EnvConfig, TournamentConfig
+from game.gameplay.matchRunner import play_matches
+from game.learning.inferenceServer import dqn_inference
+
+
+Job = namedtuple("Job", ["id", "black", "white", "games", "seed"])
+Standing = namedtuple("Standing", ["agent", "elo", "error", "games", "score"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    black TEXT NOT NULL,
+    white TEXT NOT NULL,
+    games INTEGER NOT NULL,
+    seed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    job INTEGER PRIMARY KEY REFERENCES jobs (id),
+    black_wins INTEGER NOT NULL,
+    white_wins INTEGER NOT NULL,
+    draws INTEGER NOT NULL,
+    disk_differential INTEGER NOT NULL,
+    elapsed REAL NOT NULL
+);
+"""
+
+
+def pairings(agents, mode="roundrobin", champion=None):
+    """
+    Return the (agent, agent) pairs of a tournament: every pair of agents
+    for a round robin, or the champion against every other agent for a
+    gauntlet.
+    """
+    if len(set(agents)) != len(agents) or len(agents) < 2:
+        raise ValueError(f'A tournament needs at least two different agents, got {agents}')
+    if mode == 'roundrobin':
+        return [(first, second) for index, first in enumerate(agents) for second in agents[index + 1:]]
+    if mode == 'gauntlet':
+        if champion not in agents:
+            raise ValueError(f'The gauntlet champion "{champion}" is not one of the agents')
+        return [(champion, agent) for agent in agents if agent != champion]
+
+    raise KeyError(f'Unknown tournament mode: "{mode}"')
+
+
+def schedule(pairs, games_per_pair, chunk_size=TournamentConfig.CHUNK_SIZE, seed=0):
+    """
+    Split the games of every pair into jobs. Each agent of a pair plays
+    half of the games as black, and every job has an even number of games,
+    so Environment.new_episode lets each side start equally often. The
+    games per pair are rounded up to a multiple of 4 to allow this.
+    """
+    chunk_size += chunk_size % 2
+    half = math.ceil(games_per_pair / 4) * 2
+    jobs = []
+    for first, second in pairs:
+        for black, white in ((first, second), (second, first)):
+            for start in range(0, half, chunk_size):
+                jobs.append(Job(len(jobs), black, white, min(chunk_size, half - start), seed + len(jobs)))
+    return jobs
+
+
+class TournamentStore(object):
+    """
+    Keeps the schedule and the finished jobs of a tournament in a SQLite
+    file. Every result is committed as soon as its job is done, so an
+    interrupted tournament resumes with the jobs that are still missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def config(self):
+        """ Return the configuration the tournament was started with, or None for a new file """
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def start(self, config, jobs):
+        """
+        Store the configuration and the schedule of a new tournament. An
+        existing tournament is kept if it was started with the same
+        configuration.
+        """
+        stored = self.config()
+        if stored is not None:
+            if stored != config:
+                raise ValueError(f'{self.path} holds a tournament with a different configuration: {stored}')
+            return
+        with self.connection:
+            self.connection.execute("INSERT INTO meta VALUES ('config', ?)", (json.dumps(config),))
+            self.connection.executemany("INSERT INTO jobs VALUES (?, ?, ?, ?, ?)", jobs)
+
+    def pending(self):
+        """ Return the jobs without a result """
+        rows = self.connection.execute(
+            "SELECT * FROM jobs WHERE id NOT IN (SELECT job FROM results) ORDER BY id").fetchall()
+        return [Job(*row) for row in rows]
+
+    def record(self, job_id, result):
+        """ Store and commit the MatchResult of one job """
+        with self.connection:
+            self.connection.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                                    (job_id, result.black_score, result.white_score, result.draws,
+                                     int(result.disk_differential), result.elapsed))
+
+    def pair_results(self):
+        """ Return (black, white, black wins, white wins, draws) summed over the finished jobs """
+        return self.connection.execute(
+            "SELECT black, white, SUM(black_wins), SUM(white_wins), SUM(draws) "
+            "FROM jobs JOIN results ON results.job = jobs.id GROUP BY black, white").fetchall()
+
+    def progress(self):
+        """ Return the number of (finished, scheduled) games """
+        scheduled = self.connection.execute("SELECT COALESCE(SUM(games), 0) FROM jobs").fetchone()[0]
+        finished = self.connection.execute(
+            "SELECT COALESCE(SUM(black_wins + white_wins + draws), 0) FROM results").fetchone()[0]
+        return finished, scheduled
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def elo_ratings(pair_results, base=TournamentConfig.ELO_BASE, prior_draws=TournamentConfig.ELO_PRIOR_DRAWS,
+                z=TournamentConfig.ELO_CONFIDENCE_Z):
+    """
+    Fit Elo ratings to the results of a tournament by maximum likelihood
+    (a Bradley-Terry model on the Elo scale, draws counting half a win).
+    Every agent also gets prior_draws draws against a virtual opponent
+    rated base, which keeps the ratings finite for unbeaten agents. The
+    ratings are shifted to average base, and the error is z standard
+    errors, taken from the curvature of the likelihood. Returns the
+    standings, best agent first.
+    """
+    agents = sorted({name for row in pair_results for name in row[:2]})
+    if not agents:
+        return []
+    index = {name: position for position, name in enumerate(agents)}
+    num = len(agents)
+    games = np.zeros(shape=(num, num))
+    scores = np.zeros(shape=(num, num))
+    for black, white, black_wins, white_wins, draws in pair_results:
+        i, j = index[black], index[white]
+        games[i, j] += black_wins + white_wins + draws
+        games[j, i] += black_wins + white_wins + draws
+        scores[i, j] += black_wins + draws / 2
+        scores[j, i] += white_wins + draws / 2
+
+    scale = math.log(10) / 400
+    ratings = np.zeros(num)
+    for _ in range(100):
+        expected = 1 / (1 + np.exp(-scale * (ratings[:, None] - ratings[None, :])))
+        prior = 1 / (1 + np.exp(-scale * ratings))
+        gradient = scale * ((scores - games * expected).sum(axis=1) + prior_draws * (0.5 - prior))
+        curvature = scale ** 2 * games * expected * (1 - expected)
+        hessian = curvature - np.diag(curvature.sum(axis=1) + scale ** 2 * prior_draws * prior * (1 - prior))
+        step = np.linalg.solve(hessian, gradient)
+        ratings -= step
+        if np.abs(step).max() < 1e-6:
+            break
+
+    # Ratings are reported relative to the mean of the field, which the
+    # results pin down far better than the virtual opponent does
+    center = np.eye(num) - 1 / num
+    ratings = center @ ratings
+    errors = z * np.sqrt(np.diag(center @ np.linalg.inv(-hessian) @ center.T))
+    played = games.sum(axis=1)
+    score = np.divide(scores.sum(axis=1), played, out=np.zeros(num), where=played > 0)
+    standings = [Standing(agent, base + ratings[i], errors[i], int(played[i]), score[i])
+                 for i, agent in enumerate(agents)]
+    return sorted(standings, key=lambda standing: -standing.elo)
+
+
+def format_standings(standings):
+    """ Return a printable table of the standings """
+    lines = [f"{'rank':>4}  {'agent':<12} {'elo':>7} {'error':>7} {'games':>7} {'score':>7}"]
+    for rank, standing in enumerate(standings, 1):
+        lines.append(f"{rank:>4}  {standing.agent:<12} {standing.elo:>7.0f} {'±':>2}{standing.error:>4.0f} "
+                     f"{standing.games:>7} {100 * standing.score:>6.1f}%")
+    return "\n".join(lines)
+
+
+def _play_job(args):
+    job, backend, endgame_empties, size, inference = args
+    start_time = time.perf_counter()
+    result = play_matches(job.black, job.white, job.games, backend, job.seed, endgame_empties, size=size,
+                          inference=inference)
+    result.elapsed = time.perf_counter() - start_time
+    return job.id, result
+
+
+def run_tournament(path, agents, mode="roundrobin", champion=None, games_per_pair=TournamentConfig.GAMES_PER_PAIR,
+                   backend="array", num_workers=None, endgame_empties=0, size=EnvConfig.DIMENSION_OF_GRID,
+                   seed=0, chunk_size=TournamentConfig.CHUNK_SIZE, verbose=1, inference_server=False):
+    """
+    Play a round robin or gauntlet tournament between the named agents
+    over a process pool, storing every finished job in the SQLite file at
+    path. Running it again with the same arguments resumes an interrupted
+    tournament. With inference_server, the dqn agents of all processes
+    share one InferenceServer. Returns the Elo standings of the stored
+    results.
+    """
+    if 'human' in agents:
+        raise ValueError('Human agents cannot play in a tournament')
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    config = {'agents': list(agents), 'mode': mode, 'champion': champion, 'games_per_pair': games_per_pair,
+              'backend': backend, 'endgame_empties': endgame_empties, 'size': size, 'seed': seed,
+              'chunk_size': chunk_size}
+    jobs = schedule(pairings(list(agents), mode, champion), games_per_pair, chunk_size, seed)
+
+    with TournamentStore(path) as store:
+        store.start(config, jobs)
+        pending = store.pending()
+        finished, scheduled = store.progress()
+        if verbose > 0 and finished:
+            print(f"Resuming {path}: {finished} of {scheduled} games already played")
+
+        start_time = time.perf_counter()
+        played = 0
+        with dqn_inference(agents, inference_server and bool(pending), size) as inference:
+            tasks = [(job, backend, endgame_empties, size, inference) for job in pending]
+            if num_workers == 1:
+                results = map(_play_job, tasks)
+                pool = None
+            else:
+                pool = multiprocessing.Pool(num_workers)
+                results = pool.imap_unordered(_play_job, tasks)
+            try:
+                for job_id, result in results:
+                    store.record(job_id, result)
+                    played += result.games
+                    if verbose > 0:
+                        elapsed = time.perf_counter() - start_time
+                        print(f"{finished + played}/{scheduled} games ({played / elapsed:.2f} games/s)")
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
+
+        return elo_ratings(store.pair_results())
@@ -0,0 +1,252 @@
+import numpy as np
+
+from config import EnvConfig
+from game.gameplay.environment import Environment, Event, Player
+
+
+# Events are returned as small integer codes so they fit in one array.
+EVENTS = list(Event)
+EVENT_CODES = {event: code for code, event in enumerate(EVENTS)}
+
+
+def shift_boards(boards, direction):
+    """ Move every cell of a (N, size, size) batch one step along direction """
+    size = boards.shape[-1]
+    dr, dc = direction
+    shifted = np.zeros_like(boards)
+    shifted[:, max(dr, 0):size + min(dr, 0), max(dc, 0):size + min(dc, 0)] = \
+        boards[:, max(-dr, 0):size + min(-dr, 0), max(-dc, 0):size + min(-dc, 0)]
+    return shifted
+
+
+def split_sides(fields, players):
+    """ Return the (own, opponent) boolean boards of players """
+    players = np.asarray(players).reshape(-1, 1, 1)
+    return fields == players, fields == 3 - players
+
+
+def legal_moves(fields, players):
+    """ Return a boolean (N, size, size) mask of the legal moves of players """
+    own, opp = split_sides(fields, players)
+    empty = fields == Player.NONE.value
+    legal = np.zeros_like(own)
+    for direction in Environment.DIRECTION:
+        x = shift_boards(own, direction) & opp
+        for _ in range(fields.shape[-1] - 3):
+            x |= shift_boards(x, direction) & opp
+        legal |= shift_boards(x, direction) & empty
+    return legal
+
+
+def flipped_disks(fields, players, moves):
+    """
+    Return a boolean (N, size, size) mask of the disks flipped when each
+    board plays its move, given as a flat index row * size + col.
+    """
+    num, size = fields.shape[0], fields.shape[-1]
+    own, opp = split_sides(fields, players)
+    placed = np.zeros(shape=(num, size * size), dtype=bool)
+    placed[np.arange(num), moves] = True
+    placed = placed.reshape(num, size, size)
+
+    flips = np.zeros_like(own)
+    for direction in Environment.DIRECTION:
+        frontier = shift_boards(placed, direction) & opp
+        line = frontier.copy()
+        closed = np.zeros(num, dtype=bool)
+        for _ in range(size - 2):
+            frontier = shift_boards(frontier, direction)
+            closed |= (frontier & own).any(axis=(1, 2))
+            frontier &= opp
+            line |= frontier
+        flips |= line & closed[:, None, None]
+    return flips
+
+
+def captured_disks(fields, players, weights=None):
+    """
+    Return a (N, size, size) array holding, for every empty grid, the
+    number of disks players would flip by playing there. With weights, a
+    (size, size) table, the weights of the flipped disks are summed instead.
+    """
+    size = fields.shape[-1]
+    own, opp = split_sides(fields, players)
+    if weights is None:
+        weights = np.ones(shape=(size, size), dtype=np.int64)
+    weights = np.asarray(weights)[None]
+
+    captured = np.zeros(fields.shape, dtype=weights.dtype)
+    for direction in Environment.DIRECTION:
+        # Shifting against the direction brings the k-th grid along it to every grid
+        back = (-direction[0], -direction[1])
+        ahead_own, ahead_opp, ahead_weight = own, opp, weights
+        alive = np.ones_like(own)
+        line = np.zeros_like(captured)
+        for _ in range(size - 1):
+            ahead_own = shift_boards(ahead_own, back)
+            ahead_opp = shift_boards(ahead_opp, back)
+            ahead_weight = shift_boards(ahead_weight, back)
+            captured += np.where(alive & ahead_own, line, 0)
+            alive &= ahead_opp
+            if not alive.any():
+                break
+            line += ahead_weight
+    captured[fields != Player.NONE.value] = 0
+    return captured
+
+
+def choose_moves(scores, candidates):
+    """
+    Return the flat index of the best scoring candidate grid of every
+    board, breaking ties uniformly at random, or -1 for a board without
+    candidates. scores and candidates are (N, size, size) arrays.
+    """
+    num = scores.shape[0]
+    scores = scores.reshape(num, -1)
+    candidates = candidates.reshape(num, -1)
+    best = np.where(candidates, scores, -np.inf).max(axis=1, keepdims=True)
+    keys = np.random.random_sample(scores.shape)
+    keys[~(candidates & (scores == best))] = -1
+    moves = keys.argmax(axis=1)
+    moves[~candidates.any(axis=1)] = -1
+    return moves
+
+
+class VectorEnvironment(object):
+    """
+    Represents N Reversi games that advance in lockstep. All boards are
+    stored in one (N, GRID_NUM, GRID_NUM) array and every rule is applied
+    to the whole batch at once.
+    """
+
+    GRID_NUM = EnvConfig.DIMENSION_OF_GRID
+
+    def __init__(self, num_envs, verbose=1, size=EnvConfig.DIMENSION_OF_GRID):
+        """
+        Create num_envs Reversi games on size x size boards.
+        """
+        self.GRID_NUM = size
+        self.verbose = verbose
+        self.num_envs = num_envs
+        self.fields = np.zeros(shape=(num_envs, size, size), dtype=np.int8)
+        self.turn = np.full(num_envs, Player.BLACK.value, dtype=np.int8)
+        self.start = np.full(num_envs, Player.BLACK.value, dtype=np.int8)
+        self.turn_count = np.zeros(num_envs, dtype=np.int32)
+        self.results = np.full(num_envs, -1, dtype=np.int8)
+        self.black_score = np.zeros(num_envs, dtype=np.int64)
+        self.white_score = np.zeros(num_envs, dtype=np.int64)
+        self.new_episode()
+
+    @property
+    def num_actions(self):
+        """ Get the number of actions the agent can take. """
+        return self.GRID_NUM * self.GRID_NUM
+
+    @property
+    def observation_shape(self):
+        """ Shape of the planes written by get_observation for one board """
+        return 4, self.GRID_NUM, self.GRID_NUM
+
+    def get_observation(self, out=None):
+        """
+        Observe every board from the view of its side to move as the four
+        planes of Environment.get_observation, written into out, a
+        preallocated (num_envs,) + observation_shape array.
+        """
+        if out is None:
+            out = np.zeros((self.num_envs,) + self.observation_shape, dtype=np.float32)
+        players = self.turn.reshape(-1, 1, 1)
+        np.equal(self.fields, players, out=out[:, 0])
+        np.equal(self.fields, 3 - players, out=out[:, 1])
+        out[:, Environment.LEGAL_PLANE] = self.legal_moves()
+        out[:, 3] = (self.turn == Player.BLACK.value)[:, None, None]
+        return out
+
+    def new_episode(self, mask=None):
+        """ Reset the boards selected by mask (all by default) to a new game. """
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        size = self.GRID_NUM
+        half = size // 2
+
+        self.fields[mask] = Player.NONE.value
+        self.fields[mask, half, half] = Player.WHITE.value
+        self.fields[mask, half - 1, half - 1] = Player.WHITE.value
+        self.fields[mask, half - 1, half] = Player.BLACK.value
+        self.fields[mask, half, half - 1] = Player.BLACK.value
+        self.turn_count[mask] = 0
+
+        self.start[mask] = 3 - self.start[mask]
+        self.turn[mask] = self.start[mask]
+
+    def legal_moves(self, players=None):
+        """ Return the legal move mask of players, the side to move by default """
+        if players is None:
+            players = self.turn
+        return legal_moves(self.fields, players)
+
+    def num_white_disks(self):
+        """ Return number of white disks on every field """
+        return np.count_nonzero(self.fields == Player.WHITE.value, axis=(1, 2))
+
+    def num_black_disks(self):
+        """ Return number of black disks on every field """
+        return np.count_nonzero(self.fields == Player.BLACK.value, axis=(1, 2))
+
+    def winning_player(self):
+        """ Return the Player value that leads on every field """
+        diff = self.num_black_disks() - self.num_white_disks()
+        winners = np.full(self.num_envs, Player.NONE.value, dtype=np.int8)
+        winners[diff > 0] = Player.BLACK.value
+        winners[diff < 0] = Player.WHITE.value
+        return winners
+
+    def step(self, actions):
+        """
+        Place one disk on every board. actions holds a flat index
+        row * GRID_NUM + col per board. Returns an array of event codes
+        (see EVENT_CODES); finished boards are reset to a new game and
+        their winner is kept in results.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        size = self.GRID_NUM
+        events = np.full(self.num_envs, EVENT_CODES[Event.NOT_VALID_MOVE], dtype=np.int8)
+        self.results.fill(-1)
+
+        in_grid = (actions >= 0) & (actions < size * size)
+        legal = self.legal_moves().reshape(self.num_envs, -1)
+        valid = in_grid & legal[np.arange(self.num_envs), np.where(in_grid, actions, 0)]
+        index = np.flatnonzero(valid)
+        if index.size == 0:
+            return events
+
+        fields = self.fields[index]
+        players = self.turn[index]
+        moves = actions[index]
+        flips = flipped_disks(fields, players, moves)
+        flips.reshape(index.size, -1)[np.arange(index.size), moves] = True
+        self.fields[index] = np.where(flips, players[:, None, None], fields)
+        self.turn_count[index] += 1
+
+        opponents = 3 - players
+        opponent_can_move = legal_moves(self.fields[index], opponents).any(axis=(1, 2))
+        player_can_move = legal_moves(self.fields[index], players).any(axis=(1, 2))
+
+        end_game = ~opponent_can_move & ~player_can_move
+        no_moves = ~opponent_can_move & player_can_move
+        events[index] = EVENT_CODES[Event.PLACEMENT_SUCCESS]
+        events[index[no_moves]] = EVENT_CODES[Event.NO_POSSIBLE_MOVES]
+        events[index[end_game]] = EVENT_CODES[Event.END_GAME]
+        self.turn[index[opponent_can_move]] = opponents[opponent_can_move]
+
+        finished = index[end_game]
+        if finished.size:
+            winners = self.winning_player()[finished]
+            self.results[finished] = winners
+            self.black_score[finished] += winners == Player.BLACK.value
+            self.white_score[finished] += winners == Player.WHITE.value
+            reset = np.zeros(self.num_envs, dtype=bool)
+            reset[finished] = True
+            self.new_episode(reset)
+
+        return events
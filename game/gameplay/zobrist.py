@@ -0,0 +1,34 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+ZOBRIST_SEED = 0x5EED
+
+
+@lru_cache(maxsize=None)
+def zobrist_keys(size, seed=ZOBRIST_SEED):
+    """
+    Generate the random 64-bit keys of a size x size board, indexed as
+    keys[player.value][row][col]. The keys of empty grids (value 0) are
+    zero, so they do not contribute to the hash.
+    """
+    rng = np.random.RandomState(seed + size)
+    keys = np.frombuffer(rng.bytes(8 * 3 * size * size), dtype=np.uint64).reshape(3, size, size).copy()
+    keys[0] = 0
+    return keys.tolist()
+
+
+def side_key(seed=ZOBRIST_SEED):
+    """ Return the key toggled into the hash when white is to move """
+    rng = np.random.RandomState(seed - 1)
+    return int(np.frombuffer(rng.bytes(8), dtype=np.uint64)[0])
+
+
+def hash_field(field, keys):
+    """ Compute the hash of a board from scratch """
+    field = np.asarray(field)
+    value = 0
+    for row, col in np.argwhere(field != 0).tolist():
+        value ^= keys[int(field[row][col])][row][col]
+    return value
@@ -0,0 +1,57 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+NUM_SYMMETRIES = 8
+
+
+@lru_cache(maxsize=None)
+def symmetry_permutations(size):
+    """
+    Return a (8, size * size) array whose row k lists, for every grid of
+    the k-th dihedral transform of a board, the flat index of the grid it
+    is taken from. Row 0 is the identity, rows 1-3 rotate by 90, 180 and
+    270 degrees and rows 4-7 are those rotations of the transposed board.
+    """
+    grid = np.arange(size * size).reshape(size, size)
+    boards = [np.rot90(grid, k) for k in range(4)] + [np.rot90(grid.T, k) for k in range(4)]
+    return np.stack([board.ravel() for board in boards])
+
+
+@lru_cache(maxsize=None)
+def inverse_permutations(size):
+    """ Return the (8, size * size) array mapping an action to its transformed index """
+    return np.argsort(symmetry_permutations(size), axis=1)
+
+
+@lru_cache(maxsize=None)
+def _plane_indices(size, channels):
+    """ Flat (channel, grid) gather indices of all 8 transforms, shape (8, channels, size * size) """
+    offsets = np.arange(channels).reshape(1, -1, 1) * size * size
+    return symmetry_permutations(size)[:, None, :] + offsets
+
+
+def augment(observations, targets=None):
+    """
+    Expand a (B, C, size, size) batch of observations into all 8 board
+    symmetries with a single gather, returning (8B, C, size, size) where
+    the 8 transforms of sample b are rows 8b to 8b + 7. targets follow
+    the same transforms: a (B,) array of flat action indices is mapped
+    to the transformed actions, and a (B, size * size) array of per-action
+    values (Q-values, policies, legal masks) is permuted alongside.
+    Returns (observations, targets), or just observations without targets.
+    """
+    observations = np.asarray(observations)
+    batch, channels, size = observations.shape[:3]
+    flat = observations.reshape(batch, channels * size * size)
+    augmented = flat[:, _plane_indices(size, channels)].reshape(batch * NUM_SYMMETRIES, channels, size, size)
+    if targets is None:
+        return augmented
+
+    targets = np.asarray(targets)
+    if targets.ndim == 1:
+        augmented_targets = inverse_permutations(size)[:, targets].T.reshape(-1)
+    else:
+        augmented_targets = targets[:, symmetry_permutations(size)].reshape(batch * NUM_SYMMETRIES, -1)
+    return augmented, augmented_targets
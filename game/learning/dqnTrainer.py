@@ -0,0 +1,307 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from config import DQNConfig, EnvConfig
+from game.agent import DQNAgent, create_agent
+from game.gameplay.environment import Environment, Player
+from game.gameplay.vectorEnvironment import VectorEnvironment, choose_moves
+from game.learning.qNetwork import Adam, QNetwork
+from game.learning.replayMemory import NStepBuffer, PrioritizedReplayMemory, ReplayMemory
+
+
+# Opponents with a batched policy; dqn plays the network being trained
+OPPONENT_NAMES = ['random', 'greedy', 'weighted', 'dqn']
+
+
+class DQNTrainer(object):
+    """
+    Trains a QNetwork against a batched opponent on a VectorEnvironment.
+    An actor thread plays all boards in lockstep with an epsilon-greedy
+    copy of the network and fills the replay memory, while the calling
+    thread samples minibatches and updates the network. Matrix products
+    release the GIL, so the two overlap; the learner keeps to one update
+    per TRAIN_INTERVAL environment steps and the actor runs at most one
+    tick ahead of it. The learner plays black on even boards and white on
+    odd ones, and the opponent's moves are part of its environment.
+    """
+
+    def __init__(self, directory, opponent=DQNConfig.TRAIN_OPPONENT, size=EnvConfig.DIMENSION_OF_GRID,
+                 num_envs=DQNConfig.TRAIN_ENVS, network=None, seed=None,
+                 checkpoint_interval=DQNConfig.CHECKPOINT_INTERVAL, report_interval=DQNConfig.REPORT_INTERVAL,
+                 resume=False, verbose=1):
+        """
+        With resume, the network and the step counts are loaded from the
+        last checkpoint in directory, so exploration and target updates
+        continue where they stopped. The replay memory starts empty.
+        """
+        if opponent not in OPPONENT_NAMES:
+            raise ValueError(f'The training opponent must be one of {OPPONENT_NAMES}, got "{opponent}"')
+        if seed is not None:
+            np.random.seed(seed)
+        self.directory = directory
+        self.checkpoint_interval = checkpoint_interval
+        self.report_interval = report_interval
+        self.verbose = verbose
+
+        self.env = VectorEnvironment(num_envs, verbose=0, size=size)
+        shape = self.env.observation_shape
+        counts = {}
+        if resume:
+            network = QNetwork.load(os.path.join(directory, "dqn-latest.npz"))
+            with open(os.path.join(directory, "dqn-latest.json")) as file:
+                counts = json.load(file)
+        if network is None:
+            network = QNetwork(shape, self.env.num_actions, seed=seed)
+        elif network.observation_shape != shape:
+            raise ValueError(f'The network observes {network.observation_shape}, the boards give {shape}')
+        self.network = network
+        self.target_network = self.__clone(network)
+        self.actor_network = self.__clone(network)
+        self.optimizer = Adam(network.params)
+        self.double = DQNConfig.LEARNING_METHOD == 'ddqn'
+
+        if DQNConfig.PRIORITIZED_REPLAY:
+            self.memory = PrioritizedReplayMemory(DQNConfig.MEMORY_SIZE, shape)
+        else:
+            self.memory = ReplayMemory(DQNConfig.MEMORY_SIZE, shape)
+        n = DQNConfig.MULTI_STEP_SIZE if DQNConfig.MULTI_STEP_REWARD else 1
+        self.n_step = NStepBuffer(num_envs, n, DQNConfig.DISCOUNT_FACTOR, shape)
+
+        if opponent == 'dqn':
+            self.opponent = DQNAgent(self.env, network=self.actor_network)
+        else:
+            self.opponent = create_agent(opponent, self.env)
+        self.learner = np.where(np.arange(num_envs) % 2 == 0, Player.BLACK.value, Player.WHITE.value)
+
+        # Shared between the actor and the learner, guarded by condition
+        self.condition = threading.Condition()
+        self.steps = counts.get('steps', 0)
+        self.updates = counts.get('updates', 0)
+        self.games = counts.get('games', 0)
+        self.wins = counts.get('wins', 0)
+        self.total_steps = 0
+        # The replay memory starts empty, also when resuming
+        self.start_steps, self.start_updates = self.steps, self.updates
+        self.actor_params = None
+        self.stopped = False
+        self.error = None
+
+    @staticmethod
+    def __clone(network):
+        clone = QNetwork(network.observation_shape, network.num_actions, network.hidden_layers, network.dueling)
+        clone.copy_from(network)
+        return clone
+
+    def epsilon(self, steps):
+        """ Exploration rate, annealed linearly over EPSILON_DECAY_STEPS """
+        progress = min(steps / max(DQNConfig.EPSILON_DECAY_STEPS, 1), 1.0)
+        return DQNConfig.EPSILON_START + progress * (DQNConfig.EPSILON_END - DQNConfig.EPSILON_START)
+
+    def allowed_updates(self):
+        """ Updates due after the memory holds LEARNING_STARTS steps, one per TRAIN_INTERVAL steps """
+        collected = self.steps - self.start_steps
+        return self.start_updates + max(collected - DQNConfig.LEARNING_STARTS, 0) // DQNConfig.TRAIN_INTERVAL
+
+    def __advance_opponent(self, dones, rewards):
+        """
+        Let the opponent move on every board until the learner is to move
+        everywhere, marking the boards whose game ends on the way.
+        """
+        env = self.env
+        while True:
+            waiting = env.turn != self.learner
+            if not waiting.any():
+                return
+            actions = self.opponent.act_batch(env.fields, env.turn)
+            actions[~waiting] = -1
+            env.step(actions)
+            self.__finish_games(dones, rewards)
+
+    def __finish_games(self, dones, rewards):
+        """ Set the reward and the done flag of boards whose game just ended """
+        finished = (self.env.results >= 0) & ~dones
+        if not finished.any():
+            return
+        results = self.env.results[finished]
+        learner = self.learner[finished]
+        rewards[finished] = np.where(results == learner, 1, np.where(results == Player.NONE.value, 0, -1))
+        dones |= finished
+
+    def __act(self):
+        """ Actor thread: collect transitions while the learner keeps up """
+        env = self.env
+        states = np.zeros((env.num_envs,) + env.observation_shape, dtype=np.int8)
+        next_states = np.zeros_like(states)
+        dones = np.zeros(env.num_envs, dtype=bool)
+        rewards = np.zeros(env.num_envs, dtype=np.float32)
+        ahead = max(env.num_envs // DQNConfig.TRAIN_INTERVAL, 1)
+
+        self.__advance_opponent(dones, rewards)
+        env.get_observation(states)
+        while True:
+            with self.condition:
+                while not self.stopped and self.allowed_updates() - self.updates > ahead:
+                    self.condition.wait()
+                if self.stopped or self.steps >= self.total_steps:
+                    return
+                steps = self.steps
+                params, self.actor_params = self.actor_params, None
+            if params is not None:
+                for name, value in params.items():
+                    np.copyto(self.actor_network.params[name], value)
+
+            legal = states[:, Environment.LEGAL_PLANE].astype(bool)
+            actions = self.actor_network.greedy_actions(states, legal)
+            explore = np.random.random_sample(env.num_envs) < self.epsilon(steps)
+            if explore.any():
+                actions[explore] = choose_moves(np.zeros(legal[explore].shape), legal[explore])
+
+            dones[:] = False
+            rewards[:] = 0
+            env.step(actions)
+            self.__finish_games(dones, rewards)
+            self.__advance_opponent(dones, rewards)
+            env.get_observation(next_states)
+            transitions = self.n_step.push(states, actions, rewards, next_states, dones)
+            states, next_states = next_states, states
+
+            with self.condition:
+                self.memory.add_batch(*transitions)
+                self.steps += env.num_envs
+                self.games += int(dones.sum())
+                self.wins += int((rewards[dones] > 0).sum())
+                self.condition.notify_all()
+
+    def __actor(self):
+        try:
+            self.__act()
+        except BaseException as error:
+            with self.condition:
+                self.error = error
+                self.stopped = True
+                self.condition.notify_all()
+
+    def update(self, beta=None):
+        """
+        One gradient step on a minibatch from the replay memory. The Huber
+        loss of the TD errors is weighted by the importance-sampling
+        weights, and the n-step targets bootstrap from the target network
+        at the move chosen among the legal ones (by the online network for
+        double DQN). Returns the loss.
+        """
+        with self.condition:
+            if isinstance(self.memory, PrioritizedReplayMemory):
+                indices, batch = self.memory.sample(DQNConfig.BATCH_SIZE, beta)
+            else:
+                indices, batch = self.memory.sample(DQNConfig.BATCH_SIZE)
+        size = len(batch.actions)
+        rows = np.arange(size)
+
+        legal = batch.next_states[:, Environment.LEGAL_PLANE].reshape(size, -1).astype(bool)
+        cache = []
+        if self.double:
+            q = self.network.forward(np.concatenate([batch.states, batch.next_states]), cache)
+            cache = [x[:size] for x in cache]
+            q, next_actions = q[:size], np.where(legal, q[size:], -np.inf).argmax(axis=1)
+            next_q = self.target_network.forward(batch.next_states)[rows, next_actions]
+        else:
+            q = self.network.forward(batch.states, cache)
+            next_q = np.where(legal, self.target_network.forward(batch.next_states), -np.inf).max(axis=1)
+        next_q = np.where(legal.any(axis=1) & ~batch.dones, next_q, 0)
+        targets = batch.rewards + batch.discounts * next_q
+
+        errors = q[rows, batch.actions] - targets
+        huber = np.where(np.abs(errors) < 1, 0.5 * errors ** 2, np.abs(errors) - 0.5)
+        grad_q = np.zeros_like(q)
+        grad_q[rows, batch.actions] = np.clip(errors, -1, 1) * batch.weights / size
+        self.optimizer.step(self.network.backward(cache, grad_q))
+
+        with self.condition:
+            self.memory.update_priorities(indices, errors)
+        return float(np.mean(batch.weights * huber))
+
+    def save(self):
+        """
+        Write a numbered checkpoint, and replace dqn-latest.npz with it and
+        dqn-latest.json with the step counts.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.network.save(os.path.join(self.directory, f"dqn-{self.updates:08d}.npz"))
+        latest = os.path.join(self.directory, "dqn-latest.npz")
+        # Readers such as the inference server never see a half-written file
+        self.network.save(latest + ".tmp")
+        os.replace(latest + ".tmp", latest)
+        with open(os.path.join(self.directory, "dqn-latest.json"), 'w') as file:
+            json.dump({'steps': self.steps, 'updates': self.updates, 'games': self.games, 'wins': self.wins}, file)
+        return latest
+
+    def train(self, total_steps=DQNConfig.TRAIN_STEPS):
+        """
+        Train until total_steps environment steps have been taken or
+        on Ctrl-C, saving a checkpoint at the end. Returns a dict of totals.
+        """
+        self.total_steps = total_steps
+        actor = threading.Thread(target=self.__actor, daemon=True)
+        start_steps, start_updates = self.steps, self.updates
+        start_time = last_report = time.perf_counter()
+        last_steps, last_updates, last_games, last_wins = self.steps, self.updates, self.games, self.wins
+        beta_start = getattr(self.memory, 'beta', 1.0)
+        losses = []
+        actor.start()
+        try:
+            while True:
+                with self.condition:
+                    while not self.stopped and self.steps < total_steps and self.updates >= self.allowed_updates():
+                        self.condition.wait()
+                    if self.stopped or self.updates >= self.allowed_updates():
+                        break
+                    steps = self.steps
+                beta = beta_start + min(steps / total_steps, 1.0) * (1 - beta_start)
+                losses.append(self.update(beta))
+
+                with self.condition:
+                    self.updates += 1
+                    if self.updates % DQNConfig.ACTOR_SYNC_INTERVAL == 0:
+                        self.actor_params = {name: value.copy() for name, value in self.network.params.items()}
+                    self.condition.notify_all()
+                if self.updates % DQNConfig.TARGET_UPDATE_INTERVAL == 0:
+                    self.target_network.copy_from(self.network)
+                if self.checkpoint_interval and self.updates % self.checkpoint_interval == 0:
+                    self.save()
+
+                now = time.perf_counter()
+                if self.verbose > 0 and self.report_interval and now - last_report >= self.report_interval:
+                    elapsed = now - last_report
+                    games = max(self.games - last_games, 1)
+                    print(f"{self.steps} steps, {self.updates} updates, "
+                          f"{(self.steps - last_steps) / elapsed:.0f} steps/s, "
+                          f"{(self.updates - last_updates) / elapsed:.1f} updates/s, "
+                          f"epsilon {self.epsilon(self.steps):.3f}, loss {np.mean(losses):.4f}, "
+                          f"win rate {100 * (self.wins - last_wins) / games:.1f}%")
+                    last_report, last_steps, last_updates = now, self.steps, self.updates
+                    last_games, last_wins = self.games, self.wins
+                    losses = []
+        except KeyboardInterrupt:
+            print("Stopping training...")
+        finally:
+            with self.condition:
+                self.stopped = True
+                self.condition.notify_all()
+            actor.join()
+        if self.error is not None:
+            raise self.error
+
+        elapsed = time.perf_counter() - start_time
+        return {
+            'steps': self.steps,
+            'updates': self.updates,
+            'games': self.games,
+            'checkpoint': self.save(),
+            'time': elapsed,
+            'steps_per_second': (self.steps - start_steps) / elapsed if elapsed > 0 else 0.0,
+            'updates_per_second': (self.updates - start_updates) / elapsed if elapsed > 0 else 0.0,
+        }
@@ -0,0 +1,195 @@
+import multiprocessing
+import os
+from contextlib import contextmanager
+import signal
+import threading
+import time
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+
+from config import DQNConfig, EnvConfig
+from game.gameplay.environment import Environment
+from game.learning.qNetwork import QNetwork, load_for_board
+
+
+class InferenceServer(object):
+    """
+    Serves the greedy actions of a QNetwork to many game processes. A
+    server process accepts clients on a local socket. It collects their
+    observations into one batch until max_batch observations arrived or
+    max_latency seconds passed since the first one. Then it runs one
+    forward pass for the whole batch and sends every client its actions.
+    When the network file changes, the server loads the new weights
+    between batches.
+    """
+
+    def __init__(self, network_path, max_batch=DQNConfig.INFERENCE_MAX_BATCH,
+                 max_latency=DQNConfig.INFERENCE_MAX_LATENCY, reload_interval=DQNConfig.INFERENCE_RELOAD_INTERVAL):
+        self.network_path = network_path
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.reload_interval = reload_interval
+        self.authkey = os.urandom(16)
+        self.address = None
+        self.process = None
+        self.control = None
+
+    def start(self):
+        """ Start the server process and wait until it accepts clients """
+        self.control, server_control = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(self.network_path, self.authkey, self.max_batch, self.max_latency,
+                                 self.reload_interval, server_control), daemon=True)
+        self.process.start()
+        self.address = self.control.recv()
+        return self
+
+    def connect(self):
+        """ Return a client connected to the server, for use in the current process """
+        return InferenceClient(self.address, self.authkey)
+
+    @property
+    def endpoint(self):
+        """ The (address, authkey) that InferenceClient connects with from any local process """
+        return self.address, self.authkey
+
+    def stop(self):
+        """ Ask the server process to finish and wait for it """
+        if self.process is None:
+            return
+        self.control.send(None)
+        self.process.join()
+        self.control.close()
+        self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+@contextmanager
+def dqn_inference(agents, enabled=True, size=EnvConfig.DIMENSION_OF_GRID, network_path=DQNConfig.MODEL_PATH):
+    """
+    Serve the dqn network while the block runs if enabled and dqn is one
+    of the agent names. Yields the endpoint to hand to create_agent, or
+    None when no server was started.
+    """
+    if not enabled or 'dqn' not in agents:
+        yield None
+        return
+    load_for_board(network_path, size)
+    with InferenceServer(network_path) as server:
+        yield server.endpoint
+
+
+class InferenceClient(object):
+    """
+    The connection of one game to an InferenceServer. Observations are
+    sent as the int8 bytes of the observation planes, one or more per
+    message, and the actions come back as int16 flat indices, -1 when no
+    move is legal.
+    """
+
+    def __init__(self, address, authkey):
+        self.connection = Client(address, authkey=authkey)
+
+    def request(self, observation):
+        """ Return the server's action for one observation of Environment.get_observation """
+        return int(self.request_batch(observation)[0])
+
+    def request_batch(self, observations):
+        """ Return the server's actions for a stack of observations, sent as one message """
+        self.connection.send_bytes(np.asarray(observations, dtype=np.int8).tobytes())
+        return np.frombuffer(self.connection.recv_bytes(), dtype=np.int16)
+
+    def close(self):
+        self.connection.close()
+
+
+def _accept_clients(listener, clients, lock):
+    """ Add every client that connects to the listener to clients """
+    while True:
+        try:
+            connection = listener.accept()
+        except OSError:
+            # The listener was closed when the server stopped
+            return
+        except Exception:
+            # A client that fails the handshake is ignored
+            continue
+        with lock:
+            clients.append(connection)
+
+
+def _serve(network_path, authkey, max_batch, max_latency, reload_interval, control):
+    """ Main loop of the server process """
+    # Ctrl-C is handled by the parent, which stops the server
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    network = QNetwork.load(network_path)
+    loaded_time = os.path.getmtime(network_path)
+    checked_time = time.perf_counter()
+    observation_size = int(np.prod(network.observation_shape))
+
+    listener = Listener(authkey=authkey)
+    clients, lock = [], threading.Lock()
+    threading.Thread(target=_accept_clients, args=(listener, clients, lock), daemon=True).start()
+    control.send(listener.address)
+
+    try:
+        while True:
+            with lock:
+                connections = list(clients)
+            # The timeout lets clients accepted in the meantime join the wait
+            ready = wait(connections + [control], timeout=0.05)
+            if control in ready:
+                return
+
+            # The connections and their observations, several from a batched client
+            batch, requests, rows = [], [], 0
+            deadline = time.perf_counter() + max_latency
+            while ready:
+                for connection in ready:
+                    try:
+                        data = connection.recv_bytes()
+                    except (EOFError, OSError):
+                        connection.close()
+                        with lock:
+                            clients.remove(connection)
+                        continue
+                    request = np.frombuffer(data, dtype=np.int8).reshape(-1, observation_size)
+                    batch.append(connection)
+                    requests.append(request)
+                    rows += len(request)
+                    if rows >= max_batch:
+                        break
+                timeout = deadline - time.perf_counter()
+                if rows >= max_batch or timeout <= 0:
+                    break
+                waiting = [connection for connection in connections
+                           if connection not in batch and not connection.closed]
+                if not waiting:
+                    break
+                ready = wait(waiting, timeout=timeout)[:max_batch - rows]
+
+            if batch:
+                states = np.concatenate(requests).reshape((rows,) + network.observation_shape)
+                actions = network.greedy_actions(states, states[:, Environment.LEGAL_PLANE]).astype(np.int16)
+                start = 0
+                for connection, request in zip(batch, requests):
+                    connection.send_bytes(actions[start:start + len(request)].tobytes())
+                    start += len(request)
+
+            if time.perf_counter() - checked_time > reload_interval:
+                checked_time = time.perf_counter()
+                modified_time = os.path.getmtime(network_path)
+                if modified_time != loaded_time:
+                    network = QNetwork.load(network_path)
+                    loaded_time = modified_time
+    finally:
+        listener.close()
+        with lock:
+            for connection in clients:
+                connection.close()
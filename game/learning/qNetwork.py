@@ -0,0 +1,158 @@
+import numpy as np
+
+from config import DQNConfig
+
+
+class QNetwork(object):
+    """
+    A fully connected Q-network in NumPy. Observations are flattened and
+    pass through ReLU hidden layers. A dueling network then splits into a
+    state value and per-action advantages, combined as
+    Q = V + A - mean(A); otherwise one linear layer gives Q directly.
+    A whole batch goes through one matrix product per layer.
+    """
+
+    def __init__(self, observation_shape, num_actions, hidden_layers=DQNConfig.HIDDEN_LAYERS,
+                 dueling=DQNConfig.DUEL_NETWORK, seed=None):
+        self.observation_shape = tuple(observation_shape)
+        self.num_actions = num_actions
+        self.hidden_layers = list(hidden_layers)
+        self.dueling = dueling
+
+        rng = np.random.RandomState(seed)
+        sizes = [int(np.prod(self.observation_shape))] + self.hidden_layers
+        self.params = {}
+        for layer, (fan_in, fan_out) in enumerate(zip(sizes[:-1], sizes[1:])):
+            self.__init_layer(rng, f'hidden{layer}', fan_in, fan_out)
+        if dueling:
+            self.__init_layer(rng, 'value', sizes[-1], 1)
+            self.__init_layer(rng, 'advantage', sizes[-1], num_actions)
+        else:
+            self.__init_layer(rng, 'q', sizes[-1], num_actions)
+
+    def __init_layer(self, rng, name, fan_in, fan_out):
+        """ He-initialized weights and zero biases of one dense layer """
+        self.params[f'{name}.weight'] = (rng.randn(fan_in, fan_out) * np.sqrt(2 / fan_in)).astype(np.float32)
+        self.params[f'{name}.bias'] = np.zeros(fan_out, dtype=np.float32)
+
+    def dense(self, name, x):
+        return x @ self.params[f'{name}.weight'] + self.params[f'{name}.bias']
+
+    def forward(self, observations, cache=None):
+        """
+        Return the (B, num_actions) Q-values of a batch of observations.
+        With a cache list, the inputs of every layer are kept in it for
+        backward.
+        """
+        x = np.asarray(observations, dtype=np.float32).reshape(len(observations), -1)
+        for layer in range(len(self.hidden_layers)):
+            if cache is not None:
+                cache.append(x)
+            x = np.maximum(self.dense(f'hidden{layer}', x), 0)
+        if cache is not None:
+            cache.append(x)
+        if not self.dueling:
+            return self.dense('q', x)
+        advantage = self.dense('advantage', x)
+        return self.dense('value', x) + advantage - advantage.mean(axis=1, keepdims=True)
+
+    def backward(self, cache, grad_q):
+        """ Return the gradients of all parameters given the gradient of the Q-values """
+        grads = {}
+        x = cache[-1]
+        if self.dueling:
+            grad_value = grad_q.sum(axis=1, keepdims=True)
+            grad_advantage = grad_q - grad_q.mean(axis=1, keepdims=True)
+            heads = [('value', grad_value), ('advantage', grad_advantage)]
+        else:
+            heads = [('q', grad_q)]
+        grad_x = 0
+        for name, grad in heads:
+            grads[f'{name}.weight'] = x.T @ grad
+            grads[f'{name}.bias'] = grad.sum(axis=0)
+            grad_x = grad_x + grad @ self.params[f'{name}.weight'].T
+
+        for layer in reversed(range(len(self.hidden_layers))):
+            # The ReLU passes the gradient where its output was positive
+            grad_z = grad_x * (cache[layer + 1] > 0)
+            grads[f'hidden{layer}.weight'] = cache[layer].T @ grad_z
+            grads[f'hidden{layer}.bias'] = grad_z.sum(axis=0)
+            if layer > 0:
+                grad_x = grad_z @ self.params[f'hidden{layer}.weight'].T
+        return grads
+
+    def copy_from(self, other):
+        """ Copy the weights of a network with the same architecture """
+        for name, value in other.params.items():
+            np.copyto(self.params[name], value)
+
+    def greedy_actions(self, observations, legal):
+        """
+        Return the legal action with the highest Q-value for every
+        observation, or -1 where legal, a (B, num_actions) mask, is empty.
+        """
+        q = self.forward(observations)
+        legal = np.asarray(legal, dtype=bool).reshape(len(q), -1)
+        actions = np.where(legal, q, -np.inf).argmax(axis=1)
+        actions[~legal.any(axis=1)] = -1
+        return actions
+
+    def save(self, path):
+        """ Write the weights and the architecture to an .npz file """
+        with open(path, 'wb') as file:
+            np.savez(file, observation_shape=self.observation_shape, num_actions=self.num_actions,
+                     hidden_layers=self.hidden_layers, dueling=self.dueling, **self.params)
+
+    @classmethod
+    def load(cls, path):
+        """ Create a network from a file written by save """
+        with np.load(path) as data:
+            network = cls(data['observation_shape'].tolist(), int(data['num_actions']),
+                          data['hidden_layers'].tolist(), bool(data['dueling']))
+            for name in network.params:
+                network.params[name] = data[name]
+        return network
+
+
+def load_for_board(path, size):
+    """ Load a network and check that it was trained on size x size boards """
+    network = QNetwork.load(path)
+    trained = network.observation_shape[-1]
+    if trained != size:
+        raise ValueError(f'{path} was trained on {trained}x{trained} boards, not {size}x{size}')
+    return network
+
+
+class Adam(object):
+    """
+    Adam optimizer updating the parameter arrays of a network in-place,
+    with the gradients rescaled to a maximum global norm first.
+    """
+
+    def __init__(self, params, learning_rate=DQNConfig.LEARNING_RATE, beta1=0.9, beta2=0.999, epsilon=1e-8,
+                 max_norm=DQNConfig.GRADIENT_CLIP):
+        self.params = params
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.max_norm = max_norm
+        self.moments = {name: np.zeros_like(value) for name, value in params.items()}
+        self.velocities = {name: np.zeros_like(value) for name, value in params.items()}
+        self.steps = 0
+
+    def step(self, grads):
+        """ Apply one update and return the gradient norm before clipping """
+        norm = float(np.sqrt(sum(np.vdot(grad, grad) for grad in grads.values())))
+        scale = min(1.0, self.max_norm / (norm + 1e-12)) if self.max_norm else 1.0
+        self.steps += 1
+        rate = self.learning_rate * np.sqrt(1 - self.beta2 ** self.steps) / (1 - self.beta1 ** self.steps)
+        for name, grad in grads.items():
+            grad = grad * scale
+            moment, velocity = self.moments[name], self.velocities[name]
+            moment *= self.beta1
+            moment += (1 - self.beta1) * grad
+            velocity *= self.beta2
+            velocity += (1 - self.beta2) * grad * grad
+            self.params[name] -= (rate * moment / (np.sqrt(velocity) + self.epsilon)).astype(np.float32)
+        return norm
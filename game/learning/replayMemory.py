@@ -0,0 +1,242 @@
+from collections import namedtuple
+
+import numpy as np
+
+from config import DQNConfig
+
+
+Batch = namedtuple("Batch", ["states", "actions", "rewards", "next_states", "dones", "discounts", "weights"])
+
+
+class SumTree(object):
+    """
+    Binary tree stored in one array, where every parent holds the sum of
+    its two children and the leaves hold the priorities. The root is at
+    index 1 and the leaves start at index `leaves`. Updates and lookups
+    walk one level per step for a whole batch at once.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.depth = self.leaves.bit_length() - 1
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        return self.tree[self.leaves + np.asarray(indices)]
+
+    def update(self, indices, priorities):
+        """ Set the priorities of the given leaves and refresh their ancestors """
+        nodes = self.leaves + np.asarray(indices, dtype=np.int64)
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes >> 1)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """ Return the leaf whose prefix sum range contains each value """
+        tree = self.tree
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            go_right = values >= tree[left]
+            values -= tree[left] * go_right
+            nodes = left + go_right
+        return np.minimum(nodes - self.leaves, self.capacity - 1)
+
+
+class ReplayMemory(object):
+    """
+    Fixed-size ring buffer of transitions kept in preallocated NumPy
+    arrays. Once full, the oldest transitions are overwritten. Every
+    transition stores the discount to apply to the value of its next
+    state, so n-step transitions can be mixed with one-step ones.
+    """
+
+    def __init__(self, capacity=DQNConfig.MEMORY_SIZE, state_shape=(8, 8), state_dtype=np.int8):
+        self.capacity = capacity
+        self.states = np.zeros((capacity,) + tuple(state_shape), dtype=state_dtype)
+        self.next_states = np.zeros((capacity,) + tuple(state_shape), dtype=state_dtype)
+        self.actions = np.zeros(capacity, dtype=np.int32)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.bool_)
+        self.discounts = np.zeros(capacity, dtype=np.float32)
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done, discount=DQNConfig.DISCOUNT_FACTOR):
+        """ Store one transition and return its slot """
+        index = self.position
+        self.states[index] = state
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.next_states[index] = next_state
+        self.dones[index] = done
+        self.discounts[index] = discount
+        self.position = (index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return np.array([index])
+
+    def add_batch(self, states, actions, rewards, next_states, dones, discounts=DQNConfig.DISCOUNT_FACTOR):
+        """ Store a batch of transitions and return their slots """
+        count = len(actions)
+        if count == 0:
+            return np.zeros(0, dtype=np.int64)
+        if count > self.capacity:
+            raise ValueError(f'Batch of {count} transitions exceeds the memory capacity {self.capacity}')
+        indices = (self.position + np.arange(count)) % self.capacity
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.next_states[indices] = next_states
+        self.dones[indices] = dones
+        self.discounts[indices] = discounts
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+        return indices
+
+    def gather(self, indices, weights):
+        return Batch(self.states[indices], self.actions[indices], self.rewards[indices],
+                     self.next_states[indices], self.dones[indices], self.discounts[indices], weights)
+
+    def sample(self, batch_size=DQNConfig.BATCH_SIZE):
+        """ Return (indices, batch) of transitions drawn uniformly """
+        if self.size == 0:
+            raise ValueError('Cannot sample from an empty replay memory')
+        indices = np.random.randint(0, self.size, batch_size)
+        return indices, self.gather(indices, np.ones(batch_size, dtype=np.float32))
+
+    def update_priorities(self, indices, errors):
+        """ Uniform sampling ignores priorities """
+        pass
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """
+    Replay memory sampling transitions in proportion to their priority
+    (|TD error| + epsilon) ** alpha, with importance-sampling weights
+    (N * P(i)) ** -beta normalised by their maximum. New transitions get
+    the highest priority seen so far, so each is replayed at least once soon.
+    """
+
+    def __init__(self, capacity=DQNConfig.MEMORY_SIZE, state_shape=(8, 8), state_dtype=np.int8,
+                 alpha=DQNConfig.PRIORITIZED_RATING, beta=DQNConfig.PRIORITY_IMPORTANCE,
+                 epsilon=DQNConfig.PRIORITY_EPSILON):
+        super().__init__(capacity, state_shape, state_dtype)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+
+    def add(self, state, action, reward, next_state, done, discount=DQNConfig.DISCOUNT_FACTOR):
+        indices = super().add(state, action, reward, next_state, done, discount)
+        self.tree.update(indices, self.max_priority)
+        return indices
+
+    def add_batch(self, states, actions, rewards, next_states, dones, discounts=DQNConfig.DISCOUNT_FACTOR):
+        indices = super().add_batch(states, actions, rewards, next_states, dones, discounts)
+        if len(indices):
+            self.tree.update(indices, self.max_priority)
+        return indices
+
+    def sample(self, batch_size=DQNConfig.BATCH_SIZE, beta=None):
+        """
+        Return (indices, batch) drawn with one value from each of
+        batch_size equal segments of the total priority (stratified).
+        """
+        if self.size == 0:
+            raise ValueError('Cannot sample from an empty replay memory')
+        if beta is None:
+            beta = self.beta
+        segment = self.tree.total / batch_size
+        values = (np.arange(batch_size) + np.random.random_sample(batch_size)) * segment
+        indices = np.minimum(self.tree.find(values), self.size - 1)
+
+        probabilities = self.tree.get(indices) / self.tree.total
+        weights = (self.size * np.maximum(probabilities, 1e-12)) ** -beta
+        weights /= weights.max()
+        return indices, self.gather(indices, weights.astype(np.float32))
+
+    def update_priorities(self, indices, errors):
+        """ Set the priorities of sampled transitions from their new TD errors """
+        priorities = (np.abs(errors) + self.epsilon) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+
+class NStepBuffer(object):
+    """
+    Turns one-step transitions of num_streams environments stepped in
+    lockstep (as by VectorEnvironment) into n-step transitions with the
+    discounted reward sum R = r0 + g r1 + ... + g^(n-1) r(n-1) and the
+    discount g^n for the state n steps later. When an episode ends, all
+    its pending transitions are emitted with the rewards up to the end.
+    """
+
+    def __init__(self, num_streams=1, n=DQNConfig.MULTI_STEP_SIZE, gamma=DQNConfig.DISCOUNT_FACTOR,
+                 state_shape=(8, 8), state_dtype=np.int8):
+        self.n = n
+        self.gamma = gamma
+        self.num_streams = num_streams
+        self.states = np.zeros((n, num_streams) + tuple(state_shape), dtype=state_dtype)
+        self.actions = np.zeros((n, num_streams), dtype=np.int32)
+        self.rewards = np.zeros((n, num_streams), dtype=np.float32)
+        self.pending = np.zeros(num_streams, dtype=np.int64)
+        self.step = 0
+
+    def push(self, states, actions, rewards, next_states, dones):
+        """
+        Add one transition of every stream and return the n-step
+        transitions completed by it as a tuple of arrays accepted by
+        ReplayMemory.add_batch.
+        """
+        n, gamma = self.n, self.gamma
+        slot = self.step % n
+        self.states[slot] = states
+        self.actions[slot] = actions
+        self.rewards[slot] = rewards
+        self.pending += 1
+        self.step += 1
+        dones = np.asarray(dones, dtype=np.bool_)
+
+        streams = np.arange(self.num_streams)
+        parts = []
+        returns = np.zeros(self.num_streams, dtype=np.float32)
+        for age in range(n):
+            # returns holds the discounted rewards from the transition of this age up to now
+            age_slot = (slot - age) % n
+            returns = self.rewards[age_slot] + gamma * returns
+            emit = self.pending > age
+            if age < n - 1:
+                emit &= dones
+            if emit.any():
+                rows = streams[emit]
+                parts.append((self.states[age_slot, rows], self.actions[age_slot, rows], returns[rows],
+                              rows, np.full(len(rows), gamma ** (age + 1), dtype=np.float32)))
+
+        self.pending = np.where(dones, 0, np.minimum(self.pending, n - 1))
+        if not parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return (self.states[0, empty], self.actions[0, empty], self.rewards[0, empty],
+                    self.states[0, empty], dones[empty], self.rewards[0, empty])
+
+        rows = np.concatenate([part[3] for part in parts])
+        return (np.concatenate([part[0] for part in parts]),
+                np.concatenate([part[1] for part in parts]),
+                np.concatenate([part[2] for part in parts]),
+                np.asarray(next_states)[rows],
+                dones[rows],
+                np.concatenate([part[4] for part in parts]))
+
+    def reset(self):
+        """ Drop all pending transitions """
+        self.pending[:] = 0
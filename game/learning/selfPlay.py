@@ -0,0 +1,272 @@
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import time
+
+import numpy as np
+
+from config import EnvConfig
+from game.agent import create_agent
+from game.gameplay.environment import Event, Player, create_environment
+from game.learning.inferenceServer import dqn_inference
+
+
+CHUNK_SIZE = 1024
+QUEUE_SIZE = 64
+SHARD_MB = 256
+REPORT_INTERVAL = 5.0
+
+
+class TransitionChunk(object):
+    """
+    A block of transitions in preallocated arrays. Observations are the
+    planes of Environment.get_observation stored as int8, actions are flat
+    indices row * GRID_NUM + col.
+    """
+
+    def __init__(self, capacity, observation_shape):
+        self.observations = np.zeros((capacity,) + tuple(observation_shape), dtype=np.int8)
+        self.actions = np.zeros(capacity, dtype=np.int16)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.bool_)
+        self.size = 0
+        self.games = 0
+
+    @property
+    def capacity(self):
+        return len(self.actions)
+
+    def arrays(self):
+        """ Return the filled part of the chunk as a dict of array views """
+        return {
+            'observations': self.observations[:self.size],
+            'actions': self.actions[:self.size],
+            'rewards': self.rewards[:self.size],
+            'dones': self.dones[:self.size],
+        }
+
+    def take(self):
+        """ Return a copy of the filled part with its game count and empty the chunk """
+        # The queue pickles in a background thread, so the buffers must not be shared
+        arrays = {name: values.copy() for name, values in self.arrays().items()}
+        arrays['games'] = self.games
+        self.size = self.games = 0
+        return arrays
+
+
+def play_game(env, agents, game):
+    """
+    Play one game and write its transitions into the chunk game. Each
+    colour forms its own trajectory: the last move of a colour carries
+    the result from its view (+1 win, -1 loss, 0 draw) and is done.
+    """
+    size = env.GRID_NUM
+    last_move = {}
+    game.size = 0
+    while True:
+        player = env.turn
+        index = game.size
+        env.get_observation(game.observations[index], player)
+        move = agents[player].act()
+        event = env.place_a_disk(move[0], move[1])
+        if event == Event.NOT_VALID_MOVE:
+            raise ValueError(f'{agents[player].name} agent played an invalid move {move}')
+        game.actions[index] = int(move[0]) * size + int(move[1])
+        game.rewards[index] = 0
+        game.dones[index] = False
+        last_move[player] = index
+        game.size += 1
+        if event == Event.END_GAME:
+            break
+
+    winner = env.winning_player()
+    for player, index in last_move.items():
+        game.dones[index] = True
+        if winner != Player.NONE:
+            game.rewards[index] = 1 if winner == player else -1
+    return game.size
+
+
+def _self_play_worker(worker_id, agent1, agent2, backend, size, seed, num_games, chunk_size, transitions, stop,
+                      inference=None):
+    """ Play num_games games, or fewer if stop is set, and put full chunks of transitions on the queue """
+    # Ctrl-C is handled by the parent, which asks the workers to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    random.seed(seed + worker_id)
+    np.random.seed(seed + worker_id)
+
+    env = create_environment(backend, verbose=0, size=size)
+    agents = {}
+    agents[Player.BLACK] = create_agent(agent1, env, inference=inference)
+    agents[Player.WHITE] = create_agent(agent2, env, inference=inference)
+    shape = env.observation_shape
+    game = TransitionChunk(env.GRID_NUM * env.GRID_NUM, shape)
+    chunk = TransitionChunk(chunk_size, shape)
+
+    try:
+        for _ in range(num_games):
+            if stop.is_set():
+                break
+            length = play_game(env, agents, game)
+            env.new_episode()
+            if chunk.size + length > chunk.capacity:
+                # Blocks while the queue is full, which throttles the workers
+                transitions.put(chunk.take())
+            for name, values in game.arrays().items():
+                getattr(chunk, name)[chunk.size:chunk.size + length] = values
+            chunk.size += length
+            chunk.games += 1
+        if chunk.size:
+            transitions.put(chunk.take())
+    finally:
+        for agent in agents.values():
+            agent.close()
+        transitions.put(None)
+
+
+class ShardWriter(object):
+    """
+    Writes transitions into numbered .npz shards in a directory. A shard is
+    closed once the next chunk would push it past max_bytes; a chunk larger
+    than max_bytes is split over several shards.
+    """
+
+    def __init__(self, directory, max_bytes=SHARD_MB * 2 ** 20, prefix="selfplay"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.pending = []
+        self.pending_bytes = 0
+        self.num_shards = 0
+        self.transitions = 0
+        self.paths = []
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, arrays):
+        """ Add a dict of transition arrays of equal length """
+        count = len(arrays['actions'])
+        row_bytes = sum(values[:1].nbytes for values in arrays.values())
+        start = 0
+        while start < count:
+            room = max((self.max_bytes - self.pending_bytes) // row_bytes, 0)
+            if room == 0:
+                if self.pending:
+                    self.flush()
+                    continue
+                room = 1
+            stop = min(count, start + room)
+            self.pending.append({name: values[start:stop] for name, values in arrays.items()})
+            self.pending_bytes += (stop - start) * row_bytes
+            start = stop
+
+    def flush(self):
+        """ Write the pending transitions as one shard """
+        if not self.pending:
+            return
+        arrays = {name: np.concatenate([part[name] for part in self.pending]) for name in self.pending[0]}
+        path = os.path.join(self.directory, f"{self.prefix}-{self.num_shards:05d}.npz")
+        np.savez(path, **arrays)
+        self.paths.append(path)
+        self.num_shards += 1
+        self.transitions += len(arrays['actions'])
+        self.pending = []
+        self.pending_bytes = 0
+
+    def close(self):
+        self.flush()
+
+
+def generate(agent1, agent2, directory, num_episodes, backend="array", num_workers=None, seed=0,
+             chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE, shard_mb=SHARD_MB,
+             report_interval=REPORT_INTERVAL, size=EnvConfig.DIMENSION_OF_GRID, inference_server=False):
+    """
+    Generate self-play transitions of agent1 (black) against agent2 (white)
+    on size x size boards with num_workers processes, each running its own environment. Workers
+    stream chunks of transitions through a bounded queue, so they block
+    when the writer falls behind. Every worker plays its share of the
+    num_episodes games; Ctrl-C stops them early, and the games finished so
+    far are still written. With inference_server, the dqn agents of all
+    workers share one InferenceServer. Returns a dict of totals.
+    """
+    if 'human' in (agent1, agent2):
+        raise ValueError('Human agents cannot play in self-play mode')
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    with dqn_inference((agent1, agent2), inference_server, size) as inference:
+        return _generate(agent1, agent2, directory, num_episodes, backend, num_workers, seed, chunk_size,
+                         queue_size, shard_mb, report_interval, size, inference)
+
+
+def _generate(agent1, agent2, directory, num_episodes, backend, num_workers, seed, chunk_size, queue_size,
+              shard_mb, report_interval, size, inference):
+    transitions = multiprocessing.Queue(queue_size)
+    stop = multiprocessing.Event()
+    shares = [num_episodes // num_workers + (worker_id < num_episodes % num_workers)
+              for worker_id in range(num_workers)]
+    workers = [multiprocessing.Process(target=_self_play_worker,
+                                       args=(worker_id, agent1, agent2, backend, size, seed, shares[worker_id],
+                                             chunk_size, transitions, stop, inference), daemon=True)
+               for worker_id in range(num_workers)]
+    writer = ShardWriter(directory, shard_mb * 2 ** 20)
+
+    games = received = 0
+    running = num_workers
+    start_time = last_report = time.perf_counter()
+    last_received = 0
+    for worker in workers:
+        worker.start()
+    try:
+        while running:
+            try:
+                chunk = transitions.get(timeout=1.0)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                continue
+            if chunk is None:
+                running -= 1
+                continue
+
+            games += chunk.pop('games')
+            received += len(chunk['actions'])
+            writer.append(chunk)
+
+            now = time.perf_counter()
+            if report_interval and now - last_report >= report_interval:
+                print(f"{games} games, {received} transitions, "
+                      f"{(received - last_received) / (now - last_report):.0f} transitions/s, "
+                      f"{writer.num_shards} shards written")
+                last_report, last_received = now, received
+    except KeyboardInterrupt:
+        print("Stopping self-play workers...")
+        stop.set()
+        # Keep draining so workers blocked on a full queue can finish
+        while running:
+            try:
+                chunk = transitions.get(timeout=5.0)
+            except queue.Empty:
+                break
+            if chunk is None:
+                running -= 1
+            else:
+                games += chunk.pop('games')
+                received += len(chunk['actions'])
+                writer.append(chunk)
+    finally:
+        stop.set()
+        writer.close()
+        for worker in workers:
+            worker.join(timeout=5.0)
+            if worker.is_alive():
+                worker.terminate()
+
+    elapsed = time.perf_counter() - start_time
+    return {
+        'games': games,
+        'transitions': received,
+        'shards': writer.num_shards,
+        'time': elapsed,
+        'transitions_per_second': received / elapsed if elapsed > 0 else 0.0,
+    }
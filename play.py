@@ -3,15 +3,17 @@
 """ Front-end script for Reversi game. """
 
 import json
+import os
 import sys
+import multiprocessing
 import numpy as np
-import pygame
 import argparse
 
-from game.gameplay.environment import Environment
-from game.gameplay.pyGameGUI import PyGameGUI
+from game.gameplay.environment import create_environment
 from game.gameplay.environment import Player
-from game.agent import HumanAgent, RandomAgent, GreedyAgent, WeightedGreedyAgent
+from game.gameplay.matchRunner import run_matches
+from game.agent import AGENT_NAMES, create_agent
+from config import AgentConfig, DQNConfig, EnvConfig
 
 
 def parse_command_line_args(args):
@@ -30,61 +32,177 @@ def parse_command_line_args(args):
         default='gui',
         help='Interface mode (command-line or GUI).',
     )
+    parser.add_argument(
+        '--mode',
+        type=str,
+        choices=['play', 'selfplay', 'train'],
+        default='play',
+        help='Play games, generate self-play training data, or train the dqn agent against agent2.',
+    )
     parser.add_argument(
         '--agent1',
         type=str,
-        choices=['human', 'random', 'greedy', 'weighted'],
+        choices=AGENT_NAMES,
         default='weighted',
         help='Agent1 to use.',
     )
     parser.add_argument(
         '--agent2',
         type=str,
-        choices=['human', 'random', 'greedy', 'weighted'],
+        choices=AGENT_NAMES,
         default='weighted',
         help='Agent2 to use.',
     )
+    parser.add_argument(
+        '--backend',
+        type=str,
+        choices=['array', 'bitboard'],
+        default='array',
+        help='Board representation used by the game engine.',
+    )
+    parser.add_argument(
+        '--board-size',
+        type=int,
+        choices=[6, 8, 10],
+        default=EnvConfig.DIMENSION_OF_GRID,
+        help='The number of grids along each side of the board.',
+    )
     parser.add_argument(
         '--num-episodes',
         type=int,
         default=100,
         help='The number of episodes to run consecutively.',
     )
+    parser.add_argument(
+        '--endgame-empties',
+        type=int,
+        default=AgentConfig.ENDGAME_EMPTIES,
+        help='Let the AI agents solve the game exactly from this many empty grids (0 disables).',
+    )
+    parser.add_argument(
+        '--record',
+        type=str,
+        default=None,
+        help='Append every game played by the command-line interface to this game record archive.',
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='Directory of the self-play data shards (default selfplay) or of the dqn checkpoints '
+             f'(default {os.path.dirname(DQNConfig.MODEL_PATH)}).',
+    )
+    parser.add_argument(
+        '--train-steps',
+        type=int,
+        default=DQNConfig.TRAIN_STEPS,
+        help='The number of environment steps to train the dqn agent for.',
+    )
+    parser.add_argument(
+        '--checkpoint-interval',
+        type=int,
+        default=DQNConfig.CHECKPOINT_INTERVAL,
+        help='Save the dqn network every this many updates (0 saves only at the end).',
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue training from the last checkpoint in the checkpoint directory.',
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        default=None,
+        help='Count and time the rule methods and append per-game statistics to files in this directory.',
+    )
+    parser.add_argument(
+        '--turbo',
+        action='store_true',
+        help='Start the GUI in turbo spectator mode (toggle with T, change speed with up/down).',
+    )
+    parser.add_argument(
+        '--inference-server',
+        action='store_true',
+        help='Let the dqn agents of all processes share one batched inference server.',
+    )
+    parser.add_argument(
+        '--num-workers',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='The number of processes used by the command-line interface.',
+    )
 
     return parser.parse_args(args)
 
 
-def create_agent(name, env):
-    """
-    Create a specific type of Snake AI agent.
-    Returns:
-        An instance of Ai agent.
-    """
-    if name == 'human':
-        return HumanAgent()
-    if name == 'random':
-        return RandomAgent(env)
-    if name == 'greedy':
-        return GreedyAgent(env)
-    if name == 'weighted':
-        return WeightedGreedyAgent(env)
+def play_gui(interface, agent1, agent2, num_episodes, backend='array', endgame_empties=0, profile=None,
+             turbo=False, size=EnvConfig.DIMENSION_OF_GRID):
+    from game.gameplay.pyGameGUI import PyGameGUI
+
+    if profile is not None:
+        env = create_environment(backend, output=profile, profile=True, size=size)
+    else:
+        env = create_environment(backend, size=size)
+    # The agents think on their own copy of the board, so the window can
+    # keep drawing env while they search in the background
+    agent_env = create_environment(backend, size=size)
+    if env.profiler is not None:
+        # The stats panel counts the rule methods the agents call too
+        env.profiler.attach(agent_env)
+    agents = {}
+    agents[Player.BLACK] = create_agent(agent1, agent_env, endgame_empties)
+    agents[Player.WHITE] = create_agent(agent2, agent_env, endgame_empties)
 
-    raise KeyError(f'Unknown agent type: "{name}"')
+    try:
+        gui = PyGameGUI(env, agents, agent_env)
+        gui.run(num_episodes=num_episodes, turbo=turbo)
+    finally:
+        for agent in agents.values():
+            agent.close()
 
 
-def play_gui(interface, agent1, agent2, num_episodes):
-    env = Environment()
-    agents = {}
-    agents[Player.BLACK] = create_agent(agent1, env)
-    agents[Player.WHITE] = create_agent(agent2, env)
+def play_cli(agent1, agent2, num_episodes, backend='array', num_workers=None, endgame_empties=0,
+             record=None, profile=None, size=EnvConfig.DIMENSION_OF_GRID, inference_server=False):
+    result = run_matches(agent1, agent2, num_episodes, backend, num_workers,
+                         endgame_empties=endgame_empties, record_path=record, profile_output=profile,
+                         size=size, inference_server=inference_server)
+    print(result.summary(agent1, agent2))
+
+
+def self_play(agent1, agent2, num_episodes, output, backend='array', num_workers=None,
+              size=EnvConfig.DIMENSION_OF_GRID, inference_server=False):
+    from game.learning.selfPlay import generate
+
+    totals = generate(agent1, agent2, output, num_episodes, backend, num_workers, size=size,
+                      inference_server=inference_server)
+    print(f"{totals['games']} games, {totals['transitions']} transitions in {totals['shards']} shards "
+          f"({totals['time']:.2f}s, {totals['transitions_per_second']:.0f} transitions/s)")
+
+
+def train(opponent, train_steps, output, checkpoint_interval, resume=False, size=EnvConfig.DIMENSION_OF_GRID):
+    from game.learning.dqnTrainer import DQNTrainer
 
-    gui = PyGameGUI(env, agents)
-    gui.run(num_episodes=num_episodes)
+    trainer = DQNTrainer(output, opponent, size, checkpoint_interval=checkpoint_interval, resume=resume)
+    totals = trainer.train(train_steps)
+    print(f"{totals['steps']} steps, {totals['updates']} updates, {totals['games']} games in {totals['time']:.2f}s "
+          f"({totals['steps_per_second']:.0f} steps/s, {totals['updates_per_second']:.1f} updates/s), "
+          f"saved {totals['checkpoint']}")
 
 
 def main():
     args = parse_command_line_args(sys.argv[1:])
-    play_gui(args.interface, args.agent1, args.agent2, args.num_episodes)
+    if args.mode == 'selfplay':
+        self_play(args.agent1, args.agent2, args.num_episodes, args.output or 'selfplay', args.backend,
+                  args.num_workers, args.board_size, args.inference_server)
+    elif args.mode == 'train':
+        train(args.agent2, args.train_steps, args.output or os.path.dirname(DQNConfig.MODEL_PATH),
+              args.checkpoint_interval, args.resume, args.board_size)
+    elif args.interface == 'cli':
+        play_cli(args.agent1, args.agent2, args.num_episodes, args.backend, args.num_workers,
+                 args.endgame_empties, args.record, args.profile, args.board_size, args.inference_server)
+    else:
+        play_gui(args.interface, args.agent1, args.agent2, args.num_episodes, args.backend,
+                 args.endgame_empties, args.profile, args.turbo, args.board_size)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3.6
+
+""" Round robin and gauntlet tournaments between the Reversi agents. """
+
+import argparse
+import multiprocessing
+import sys
+
+from config import AgentConfig, EnvConfig, TournamentConfig
+from game.agent import AGENT_NAMES
+from game.gameplay.tournament import TournamentStore, elo_ratings, format_standings, run_tournament
+
+
+def parse_command_line_args(args):
+    """ Parse command-line arguments and organize them into a single structured object. """
+
+    agents = [name for name in AGENT_NAMES if name != 'human']
+    parser = argparse.ArgumentParser(description='Tournaments between the Reversi agents.')
+    parser.add_argument(
+        '--results',
+        type=str,
+        default='tournament.sqlite',
+        help='SQLite file the results are stored in; an unfinished tournament in it is resumed.',
+    )
+    parser.add_argument(
+        '--agents',
+        type=str,
+        nargs='+',
+        choices=agents,
+        default=[name for name in agents if name != 'dqn'],
+        help='Agents taking part (all AI agents but dqn, which needs a trained model, by default).',
+    )
+    parser.add_argument(
+        '--format',
+        type=str,
+        choices=['roundrobin', 'gauntlet'],
+        default='roundrobin',
+        help='Every agent against every other, or the champion against all others.',
+    )
+    parser.add_argument(
+        '--champion',
+        type=str,
+        choices=agents,
+        default=None,
+        help='The agent that plays every game of a gauntlet.',
+    )
+    parser.add_argument(
+        '--games-per-pair',
+        type=int,
+        default=TournamentConfig.GAMES_PER_PAIR,
+        help='Games between each pair of agents, half with each colour.',
+    )
+    parser.add_argument(
+        '--backend',
+        type=str,
+        choices=['array', 'bitboard'],
+        default='bitboard',
+        help='Board representation used by the game engine.',
+    )
+    parser.add_argument(
+        '--board-size',
+        type=int,
+        choices=[6, 8, 10],
+        default=EnvConfig.DIMENSION_OF_GRID,
+        help='The number of grids along each side of the board.',
+    )
+    parser.add_argument(
+        '--endgame-empties',
+        type=int,
+        default=AgentConfig.ENDGAME_EMPTIES,
+        help='Let the agents solve the game exactly from this many empty grids (0 disables).',
+    )
+    parser.add_argument(
+        '--num-workers',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='The number of processes playing games.',
+    )
+    parser.add_argument(
+        '--inference-server',
+        action='store_true',
+        help='Let the dqn agents of all processes share one batched inference server.',
+    )
+    parser.add_argument(
+        '--standings',
+        action='store_true',
+        help='Only print the standings of the results stored so far.',
+    )
+
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_command_line_args(sys.argv[1:])
+    if args.standings:
+        with TournamentStore(args.results) as store:
+            print(format_standings(elo_ratings(store.pair_results())))
+        return
+
+    try:
+        standings = run_tournament(args.results, args.agents, args.format, args.champion, args.games_per_pair,
+                                   args.backend, args.num_workers, args.endgame_empties, args.board_size,
+                                   inference_server=args.inference_server)
+    except KeyboardInterrupt:
+        print(f"Interrupted; run the same command again to resume from {args.results}")
+        sys.exit(1)
+    print(format_standings(standings))
+
+if __name__ == '__main__':
+    main()